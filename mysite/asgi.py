@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+import django
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+if django.VERSION < (5, 0):
+    # Django 5.0+ cancels the responses of clients that left on its own
+    from polls.asgi import CancelOnDisconnect
+
+    application = CancelOnDisconnect(application)
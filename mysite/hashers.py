@@ -0,0 +1,61 @@
+"""
+Password hashers with a configurable cost, and hashing off the event loop.
+
+``PASSWORD_HASHER`` picks the hasher new passwords are stored with, and the
+``PASSWORD_*`` cost settings tune it.  Passwords stored with another hasher
+or cost keep working and are rehashed with the current one the next time
+their user logs in.
+
+``amake_password`` hashes on a pool of ``PASSWORD_HASH_WORKERS`` threads of
+its own: the hash functions release the GIL, so a burst of signups uses
+every core without queueing behind the single thread ``sync_to_async``
+runs the ORM on, and without blocking the event loop.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2-SHA256 with ``PASSWORD_PBKDF2_ITERATIONS`` iterations (0 for Django's default)."""
+
+    def __init__(self):
+        self.iterations = settings.PASSWORD_PBKDF2_ITERATIONS or self.iterations
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    """scrypt with a work factor (N) of ``PASSWORD_SCRYPT_WORK_FACTOR``."""
+
+    def __init__(self):
+        self.work_factor = settings.PASSWORD_SCRYPT_WORK_FACTOR
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2id with ``PASSWORD_ARGON2_TIME_COST`` passes over ``PASSWORD_ARGON2_MEMORY_COST`` KiB."""
+
+    def __init__(self):
+        self.time_cost = settings.PASSWORD_ARGON2_TIME_COST
+        self.memory_cost = settings.PASSWORD_ARGON2_MEMORY_COST
+
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_executor():
+    """Return the thread pool passwords are hashed on, creating it on first use."""
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hash')
+    return _executor
+
+
+async def amake_password(password):
+    """Hash ``password`` with the current hasher on the hashing pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), hashers.make_password, password)
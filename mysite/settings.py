@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
-from decouple import config
+
+import django
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,23 +43,32 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.RequestMetricsMiddleware',
+    'polls.middleware.PrimaryPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'polls.middleware.CachedUserAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'mysite.urls'
 
+# Compiled templates are kept in memory outside development, so a page only
+# pays for rendering; in development they are re-read on every request.
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'polls.metrics.TimedDjangoTemplates',
         'DIRS': [BASE_DIR/"templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
+            'loaders': TEMPLATE_LOADERS if DEBUG else [('django.template.loaders.cached.Loader', TEMPLATE_LOADERS)],
             'context_processors': [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
@@ -72,13 +84,138 @@ WSGI_APPLICATION = 'mysite.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+DATABASE_ENGINE = config('DATABASE_ENGINE', default='django.db.backends.sqlite3')
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'ENGINE': DATABASE_ENGINE,
+        'NAME': config('DATABASE_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        'USER': config('DATABASE_USER', default=''),
+        'PASSWORD': config('DATABASE_PASSWORD', default=''),
+        'HOST': config('DATABASE_HOST', default=''),
+        'PORT': config('DATABASE_PORT', default=''),
+        # keep connections open between requests (seconds, 0 closes after each request)
+        'CONN_MAX_AGE': config('DATABASE_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': config('DATABASE_CONN_HEALTH_CHECKS', default=True, cast=bool),
+        'OPTIONS': {},
+    }
+}
+
+if DATABASE_ENGINE == 'django.db.backends.sqlite3' and django.VERSION >= (5, 1):
+    # take the write lock when the transaction starts, so a vote waits out the
+    # busy timeout instead of failing with "database is locked" on upgrade
+    # (on older versions polls.voting takes it with its first statement)
+    DATABASES['default']['OPTIONS']['transaction_mode'] = 'IMMEDIATE'
+
+if DATABASE_ENGINE == 'django.db.backends.postgresql' and config('DATABASE_POOL', default=False, cast=bool):
+    # psycopg's connection pool (Django 5.1+ with psycopg[pool]); it replaces persistent connections
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': config('DATABASE_POOL_MIN_SIZE', default=2, cast=int),
+        'max_size': config('DATABASE_POOL_MAX_SIZE', default=10, cast=int),
+        'timeout': config('DATABASE_POOL_TIMEOUT', default=10, cast=int),
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+
+# Read replicas: a comma-separated list of the replicas' database NAMEs for
+# SQLite (e.g. a copy of db.sqlite3), or of their HOSTs for other engines.
+# Reads go to a random replica; a browser that just wrote reads from the
+# primary for POLLS_PRIMARY_PIN_SECONDS (see polls.routers).
+POLLS_READ_DATABASES = []
+for index, replica in enumerate(config('DATABASE_REPLICAS', default='', cast=Csv())):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME' if DATABASE_ENGINE == 'django.db.backends.sqlite3' else 'HOST': replica,
+        # tests read the test primary through the replica aliases
+        'TEST': {'MIRROR': 'default'},
+    }
+    POLLS_READ_DATABASES.append(alias)
+DATABASE_ROUTERS = ['polls.routers.PrimaryReplicaRouter']
+POLLS_PRIMARY_PIN_SECONDS = config('DATABASE_PRIMARY_PIN_SECONDS', default=5, cast=int)
+
+# PRAGMAs set on every new SQLite connection (see polls.signals): WAL lets readers
+# run alongside the writer, and the busy timeout (ms) makes writers wait for the lock.
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='wal'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='normal'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=128 * 1024 * 1024, cast=int),
+}
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='ku-polls'),
     }
 }
 
+# Sessions are read from the cache and written through to the database by
+# default; django.contrib.sessions.backends.signed_cookies keeps them in the
+# browser instead, with no server-side storage at all.
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
+SESSION_CACHE_ALIAS = config('SESSION_CACHE_ALIAS', default='default')
+# Where messages are kept between requests: Django's cookie-then-session
+# fallback, or polls.message_storage.CookieStorage / SessionStorage, which
+# only write when there are messages (see polls.message_storage)
+MESSAGE_STORAGE = config('MESSAGE_STORAGE', default='django.contrib.messages.storage.fallback.FallbackStorage')
+# How long (seconds) a logged in user is kept in each process's memory instead
+# of being loaded on every request (0 to turn off), and how many are kept
+POLLS_USER_CACHE_SECONDS = config('POLLS_USER_CACHE_SECONDS', default=30, cast=int)
+POLLS_USER_CACHE_SIZE = config('POLLS_USER_CACHE_SIZE', default=10000, cast=int)
+
+# cache alias and timeout (seconds) used for poll results
+POLLS_RESULTS_CACHE = config('POLLS_RESULTS_CACHE', default='default')
+POLLS_RESULTS_CACHE_TIMEOUT = config('POLLS_RESULTS_CACHE_TIMEOUT', default=300, cast=int)
+# longest time (seconds) an index listing is cached; it also expires at the next pub/end date
+POLLS_INDEX_CACHE_TIMEOUT = config('POLLS_INDEX_CACHE_TIMEOUT', default=300, cast=int)
+POLLS_INDEX_PAGE_SIZE = config('POLLS_INDEX_PAGE_SIZE', default=10, cast=int)
+# In-memory "which choice did this user pick" maps (see polls.voteindex): the
+# most votes kept per process, how often a map changed by another process is reloaded, and
+# the age past which a map is reloaded anyway (votes elsewhere go unseen without a shared cache)
+POLLS_VOTE_INDEX_MAX_ENTRIES = config('POLLS_VOTE_INDEX_MAX_ENTRIES', default=1000000, cast=int)
+POLLS_VOTE_INDEX_RELOAD_SECONDS = config('POLLS_VOTE_INDEX_RELOAD_SECONDS', default=5, cast=int)
+POLLS_VOTE_INDEX_MAX_AGE_SECONDS = config('POLLS_VOTE_INDEX_MAX_AGE_SECONDS', default=30, cast=int)
+# most questions the my-votes endpoint answers at once
+POLLS_MY_VOTES_MAX_QUESTIONS = config('POLLS_MY_VOTES_MAX_QUESTIONS', default=100, cast=int)
+# most questions voted on in one request to the batch vote endpoint
+POLLS_BATCH_VOTE_MAX_QUESTIONS = config('POLLS_BATCH_VOTE_MAX_QUESTIONS', default=100, cast=int)
+# longest vote timeline returned, in minute/hour/day buckets
+POLLS_TIMELINE_MAX_BUCKETS = config('POLLS_TIMELINE_MAX_BUCKETS', default=500, cast=int)
+
+# Vote ingestion: 'sync' writes each vote in its request,
+# 'buffered' queues votes and writes them in batches from a background thread.
+POLLS_VOTE_INGESTION = config('POLLS_VOTE_INGESTION', default='sync')
+POLLS_VOTE_BATCH_SIZE = config('POLLS_VOTE_BATCH_SIZE', default=500, cast=int)
+POLLS_VOTE_FLUSH_INTERVAL = config('POLLS_VOTE_FLUSH_INTERVAL', default=1.0, cast=float)
+
+# Most SQL queries each view may run; over budget is logged, or raises
+# QueryBudgetExceeded when POLLS_QUERY_BUDGET_MODE is 'raise' (always the case in tests).
+POLLS_QUERY_BUDGETS = {
+    'polls:index': 4,
+    'polls:detail': 6,
+    'polls:vote': 15,
+    'polls:results': 4,
+    'polls:timeline': 3,
+    'polls:my_votes': 3,
+    'polls:vote_batch': 15,
+    'signup': 11,
+}
+POLLS_QUERY_BUDGET_MODE = config('POLLS_QUERY_BUDGET_MODE', default='log')
+
+TEST_RUNNER = 'polls.testrunner.QueryBudgetTestRunner'
+
+# Serve the detail, vote and results pages with the async views (for ASGI deployments)
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', default=False, cast=bool)
+
+# Live results over Server-Sent Events: the channel that carries tally changes
+# between processes, how long changes are coalesced and the keep-alive interval.
+POLLS_EVENTS_CHANNEL = config('POLLS_EVENTS_CHANNEL', default='polls.events.InProcessChannel')
+POLLS_EVENTS_COALESCE_MS = config('POLLS_EVENTS_COALESCE_MS', default=250, cast=int)
+POLLS_EVENTS_KEEPALIVE = config('POLLS_EVENTS_KEEPALIVE', default=15, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 AUTHENTICATION_BACKENDS = [
@@ -86,6 +223,30 @@ AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# The hasher new passwords are stored with: pbkdf2 (Django's default), scrypt
+# or argon2 (pip install argon2-cffi), and its cost (see mysite.hashers).
+# Passwords stored with another hasher or cost are rehashed at their next login.
+PASSWORD_HASHER = config('PASSWORD_HASHER', default='pbkdf2')
+PASSWORD_PBKDF2_ITERATIONS = config('PASSWORD_PBKDF2_ITERATIONS', default=0, cast=int)
+PASSWORD_SCRYPT_WORK_FACTOR = config('PASSWORD_SCRYPT_WORK_FACTOR', default=2 ** 14, cast=int)
+PASSWORD_ARGON2_TIME_COST = config('PASSWORD_ARGON2_TIME_COST', default=2, cast=int)
+PASSWORD_ARGON2_MEMORY_COST = config('PASSWORD_ARGON2_MEMORY_COST', default=102400, cast=int)
+# Threads the async signup hashes passwords on
+PASSWORD_HASH_WORKERS = config('PASSWORD_HASH_WORKERS', default=os.cpu_count() or 1, cast=int)
+
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'mysite.hashers.PBKDF2PasswordHasher',
+    'scrypt': 'mysite.hashers.ScryptPasswordHasher',
+    'argon2': 'mysite.hashers.Argon2PasswordHasher',
+}
+PASSWORD_HASHERS = [
+    _PASSWORD_HASHERS[PASSWORD_HASHER],
+    *(path for name, path in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER),
+    # only to check passwords stored with them before
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -14,6 +14,7 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import RedirectView
@@ -24,6 +25,6 @@ urlpatterns = [
     path('', RedirectView.as_view(url='polls/', permanent=False)),
     path('polls/', include('polls.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
-    path('signup/', views.signup, name='signup'),
+    path('signup/', views.asignup if settings.POLLS_ASYNC_VIEWS else views.signup, name='signup'),
     path('admin/', admin.site.urls),
 ]
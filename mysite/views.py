@@ -1,6 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login
 from django.contrib.auth.forms import UserCreationForm
+from django.template.response import TemplateResponse
+
+from mysite.hashers import amake_password
 
 
 def signup(request):
@@ -8,13 +13,10 @@ def signup(request):
     if request.method == 'POST':
         form = UserCreationForm(request.POST)
         if form.is_valid():
-            form.save()
-            # get named fields from the form data
-            username = form.cleaned_data.get('username')
-            # password input field is named 'password1'
-            raw_passwd = form.cleaned_data.get('password1')
-            user = authenticate(username=username, password=raw_passwd)
-            login(request, user)
+            user = form.save()
+            # the password was just hashed and set by the form, checking it
+            # again with authenticate() would only hash it a second time
+            login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
             return redirect('polls:index')
         # what if form is not valid?
         # we should display a message in signup.html
@@ -22,3 +24,19 @@ def signup(request):
         # create a user form and display it the signup page
         form = UserCreationForm()
     return render(request, 'registration/signup.html', {'form': form})
+
+
+async def asignup(request):
+    """Register a new user, hashing the password on the hashing pool (see mysite.hashers)."""
+    if request.method == 'POST':
+        form = UserCreationForm(request.POST)
+        if await sync_to_async(form.is_valid)():
+            # the user the form built from the cleaned data, without its password set
+            user = form.instance
+            user.password = await amake_password(form.cleaned_data['password1'])
+            await user.asave()
+            await sync_to_async(login)(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+            return redirect('polls:index')
+    else:
+        form = UserCreationForm()
+    return TemplateResponse(request, 'registration/signup.html', {'form': form})
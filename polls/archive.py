@@ -0,0 +1,79 @@
+"""
+Module for moving the votes of closed questions out of the Vote table.
+
+A closed question's results are served from its frozen snapshot and its
+vote counters and timeline rollups are kept, so its raw Vote rows are only
+needed for audits.  ``archive_question_votes`` writes them to a gzip
+compressed NDJSON file and deletes them, keeping the live Vote table small.
+"""
+import gzip
+import json
+import os
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Question, Vote
+from .results import freeze_results
+from .routers import pin_primary
+
+ARCHIVE_FIELDS = ['vote_id', 'user_id', 'question_id', 'choice_id', 'created_at']
+
+
+def archivable_questions(closed_before=None):
+    """Return the closed questions whose votes are still in the Vote table."""
+    questions = Question.objects.filter(state=Question.CLOSED, votes_archived_at__isnull=True)
+    if closed_before is not None:
+        questions = questions.filter(end_date__lt=closed_before)
+    return questions
+
+
+def archive_path(directory, question_id):
+    return os.path.join(directory, f'question-{question_id}-votes.ndjson.gz')
+
+
+def archive_question_votes(question_id, directory, prune=True, chunk_size=2000):
+    """
+    Write the votes of a closed question to a gzip NDJSON file, then delete them.
+
+    The file is written under a temporary name and renamed once complete, and
+    the votes are only deleted after that, in one transaction with marking
+    the question archived.
+
+    Args:
+        question_id (int): A closed question.
+        directory (str): Where to write ``question-<id>-votes.ndjson.gz``.
+        prune (bool): Delete the archived votes from the Vote table.
+        chunk_size (int): Rows fetched from the database at a time.
+
+    Returns:
+        tuple: The path of the archive and the number of votes in it.
+
+    Raises:
+        ValueError: If the question is not closed.
+    """
+    with pin_primary():
+        if not Question.objects.filter(pk=question_id, state=Question.CLOSED).exists():
+            raise ValueError(f"Question {question_id} is not closed.")
+        # the results of the question will no longer be computable from its votes
+        freeze_results([question_id])
+        os.makedirs(directory, exist_ok=True)
+        path = archive_path(directory, question_id)
+        rows = Vote.objects.filter(question_id=question_id).order_by('id').values_list(
+            'id', 'user_id', 'question_id', 'choice_id', 'created_at',
+        )
+        count = 0
+        last_id = 0
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as archive:
+            for row in rows.iterator(chunk_size=chunk_size):
+                archive.write(json.dumps(dict(zip(ARCHIVE_FIELDS, row)), cls=DjangoJSONEncoder) + '\n')
+                count += 1
+                last_id = row[0]
+        os.replace(path + '.tmp', path)
+        if prune:
+            with transaction.atomic():
+                # only the rows in the file, should a late buffered vote have come in since
+                Vote.objects.filter(question_id=question_id, id__lte=last_id).delete()
+                Question.objects.filter(pk=question_id).update(votes_archived_at=timezone.now())
+    return path, count
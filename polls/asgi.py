@@ -0,0 +1,50 @@
+"""
+Module for the ASGI middleware that ends the responses of clients that left.
+
+Before Django 5.0 the ASGI handler stops reading from the server once the
+request body is in, so it never sees ``http.disconnect``: a streaming
+response such as the ``results/stream`` Server-Sent Events runs, and keeps
+its subscription, forever after its client left.  ``CancelOnDisconnect``
+listens for the disconnect itself and cancels the request's task, which
+raises ``CancelledError`` in the response's iterator as Django 5.0 does.
+"""
+import asyncio
+
+
+class CancelOnDisconnect:
+    """Wraps an ASGI application, cancelling each HTTP request whose client disconnects."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        body_read = asyncio.Event()
+
+        async def receive_body():
+            message = await receive()
+            if message['type'] != 'http.request' or not message.get('more_body', False):
+                body_read.set()
+            return message
+
+        request = asyncio.ensure_future(self.app(scope, receive_body, send))
+        watcher = asyncio.ensure_future(self._disconnected(receive, body_read))
+        try:
+            await asyncio.wait([request, watcher], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            watcher.cancel()
+            if not request.done():
+                # the client left, or the server cancelled this call
+                request.cancel()
+        try:
+            await request
+        except asyncio.CancelledError:
+            pass
+
+    @staticmethod
+    async def _disconnected(receive, body_read):
+        # the application reads the body; after it, the only message left is the disconnect
+        await body_read.wait()
+        while (await receive())['type'] != 'http.disconnect':
+            pass
@@ -0,0 +1,197 @@
+"""
+Async versions of the vote, detail and results views.
+
+Used instead of the views in ``polls.views`` when ``POLLS_ASYNC_VIEWS`` is
+on and the project is served through ASGI (``mysite/asgi.py``).  Reads go
+through Django's async ORM and cache APIs, so a request only leaves the
+event loop to load the session user and to write a vote, which needs a
+transaction.
+
+``results_stream`` is always async: it holds a Server-Sent Events
+connection open for each subscriber without tying up a thread.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views import View
+
+from . import voteindex
+from .conditional import add_validators, csrf_secret, not_modified, page_etag
+from .events import get_broker
+from .ingest import get_vote_buffer, is_buffered
+from .models import Choice, Question, Vote
+from .results import aget_results
+from .states import aensure_current
+from .voting import record_vote
+
+
+def _load_user(request):
+    """Evaluate the lazy ``request.user``, which loads the session and the user."""
+    user = request.user
+    user.is_authenticated
+    return user
+
+
+async def aget_user(request):
+    """Return the user of ``request`` without blocking the event loop."""
+    if hasattr(request, 'auser'):
+        return await request.auser()
+    return await sync_to_async(_load_user)(request)
+
+
+async def _detail_response(request, question, user_vote=None, status=200):
+    choices = [choice async for choice in question.choice_set.all()]
+    context = {'question': question, 'choices': choices, 'user_vote': user_vote, 'error_message': None}
+    return TemplateResponse(request, 'polls/detail.html', context, status=status)
+
+
+async def vote(request, question_id):
+    """
+    Record a vote for a specific question and handle the redirection.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        question_id (int): The ID of the question to vote on.
+
+    Returns:
+        HttpResponseRedirect: Redirects to the results page after the vote is recorded.
+    """
+    user = await aget_user(request)
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    now = timezone.now()
+    await aensure_current(now)
+    try:
+        question = await Question.objects.aget(pk=question_id)
+    except Question.DoesNotExist:
+        raise Http404("Question does not exist")
+    # from the clock too: the stored state lags when another process changed the dates
+    state = question.state_at(now)
+
+    # Check if the question is published
+    if state == Question.SCHEDULED:
+        messages.error(request, "This question is not currently published.")
+        return HttpResponseRedirect(reverse('polls:index'))
+
+    try:
+        selected_choice = await question.choice_set.aget(pk=request.POST['choice'])
+    except (KeyError, ValueError, Choice.DoesNotExist):
+        messages.error(request, "You didn't select a choice.")
+        return await _detail_response(request, question)
+
+    # Check if the end date has passed
+    if state == Question.CLOSED:
+        messages.error(request, 'Voting for this question is not allowed as the end date has passed.')
+        return HttpResponseRedirect(reverse('polls:index'))
+
+    if is_buffered():
+        get_vote_buffer().submit(user.id, question.id, selected_choice.id)
+        messages.success(request, f"Your vote for '{question.question_text}' has been received.")
+        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+    await sync_to_async(record_vote)(user, question, selected_choice)
+
+    # Display a success message
+    messages.success(request, f"Your vote for '{question.question_text}' has been recorded successfully.")
+    return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
+
+
+class DetailView(View):
+    """View for displaying the details of a specific question."""
+
+    async def get(self, request, pk):
+        """Shows a published question with the user's previous vote selected."""
+        user = await aget_user(request)
+        # Check if the user is authenticated, and if not, redirect to the login page.
+        if not user.is_authenticated:
+            return redirect("login")
+        await aensure_current()
+        try:
+            question = await Question.objects.exclude(state=Question.SCHEDULED).aget(pk=pk)
+        except Question.DoesNotExist:
+            raise Http404("No question found matching the query")
+        last_modified = question.last_modified()
+        etag = page_etag(question.id, last_modified, user.id, csrf_secret(request))
+        response = await sync_to_async(not_modified)(request, etag, last_modified)
+        if response is None:
+            choice_id = await voteindex.aget_choice(user.id, question.id)
+            user_vote = None if choice_id is None else Vote(user=user, question=question, choice_id=choice_id)
+            response = await _detail_response(request, question, user_vote)
+        return add_validators(response, etag, last_modified)
+
+
+class ResultsView(View):
+    """View for displaying the results of a specific question."""
+
+    async def get(self, request, pk):
+        """Shows the cached results of the question."""
+        results = await aget_results(pk)
+        user = await aget_user(request)
+        etag = page_etag(results['question']['id'], results['last_modified'], user.id)
+        response = await sync_to_async(not_modified)(request, etag, results['last_modified'])
+        if response is None:
+            context = {'question': results['question'], 'results': results}
+            response = TemplateResponse(request, 'polls/results.html', context)
+        return add_validators(response, etag, results['last_modified'])
+
+
+def _sse(event, data):
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+async def _result_events(question_id, results):
+    broker = get_broker()
+    subscriber = broker.subscribe(question_id)
+    try:
+        yield _sse('snapshot', results)
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), settings.POLLS_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                # keeps proxies from closing the connection; a client that left cancels the stream (see polls.asgi)
+                yield ": keepalive\n\n"
+                continue
+            if message is None or subscriber.resync:
+                subscriber.resync = False
+                yield _sse('snapshot', await aget_results(question_id))
+            else:
+                yield _sse('tally', message)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def results_stream(request, pk):
+    """
+    Stream the results of a question as Server-Sent Events.
+
+    The stream starts with a ``snapshot`` event holding the full results,
+    followed by ``tally`` events with the change of each choice's vote count.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        pk (int): The ID of the question.
+
+    Returns:
+        StreamingHttpResponse: A ``text/event-stream`` response that stays open,
+        or 501 Not Implemented when served through WSGI.
+    """
+    if not isinstance(request, ASGIRequest):
+        # WSGI collects a whole async stream before sending it, and this one never ends
+        return HttpResponse("Live results need the ASGI server.", status=501, content_type='text/plain')
+    results = await aget_results(pk)
+    response = StreamingHttpResponse(_result_events(pk, results), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
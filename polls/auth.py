@@ -0,0 +1,66 @@
+"""
+Module for keeping recently seen users in memory between requests.
+
+``django.contrib.auth`` loads the user of a session from the database on
+every request.  ``get_user`` keeps the users it loaded for
+``POLLS_USER_CACHE_SECONDS`` in this process, keyed by the user id, backend
+and session auth hash stored in the session; the hash is derived from the
+password, so a session from before a password change never matches.
+
+A user is dropped from the cache when it is saved (a password change, a
+deactivation, ...) or logs out in this process; other processes notice
+those within ``POLLS_USER_CACHE_SECONDS``.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.models import AnonymousUser
+
+_lock = threading.Lock()
+_users = {}
+
+
+def _key(session):
+    user_id = session.get(auth.SESSION_KEY)
+    if user_id is None:
+        return None
+    return str(user_id), session.get(auth.BACKEND_SESSION_KEY), session.get(auth.HASH_SESSION_KEY)
+
+
+def get_user(request):
+    """Return the user of ``request``'s session, from the cache when possible."""
+    timeout = settings.POLLS_USER_CACHE_SECONDS
+    key = _key(request.session)
+    if key is None:
+        return AnonymousUser()
+    if timeout:
+        with _lock:
+            entry = _users.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            # a copy, so changes a request makes to its user stay in that request
+            return copy.copy(entry[1])
+    user = auth.get_user(request)
+    if timeout and user.is_authenticated:
+        with _lock:
+            if len(_users) >= settings.POLLS_USER_CACHE_SIZE:
+                # drop the oldest entry
+                del _users[next(iter(_users))]
+            _users[key] = (time.monotonic() + timeout, copy.copy(user))
+    return user
+
+
+def forget_user(user_id):
+    """Drop every cached copy of the user ``user_id``."""
+    user_id = str(user_id)
+    with _lock:
+        for key in [key for key in _users if key[0] == user_id]:
+            del _users[key]
+
+
+def clear():
+    """Drop every cached user."""
+    with _lock:
+        _users.clear()
@@ -0,0 +1,169 @@
+"""
+Module for benchmarking the hot paths of the polls app.
+
+``seed`` fills the database with a reproducible volume of users, questions,
+choices and votes, and ``run_benchmark`` drives the index, detail, vote and
+results pages through the Django test client, measuring latency percentiles,
+requests per second and queries per request for each endpoint.
+"""
+import itertools
+import math
+import platform
+import random
+import time
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import Choice, Question, Vote
+from .voting import rebuild_vote_counts
+
+ENDPOINTS = ('index', 'detail', 'vote', 'results')
+
+
+def seed(questions=100, choices=4, users=1000, votes=10000, rng_seed=0, batch_size=5000):
+    """
+    Create a reproducible data set for the benchmark with bulk inserts.
+
+    Each user votes at most once per question, so ``votes`` is capped at
+    ``users * questions``.
+
+    Returns:
+        dict: The number of rows created per model.
+    """
+    rng = random.Random(rng_seed)
+    now = timezone.now()
+    password = make_password('benchmark')
+    User.objects.bulk_create(
+        [User(username=f'bench{i}', password=password) for i in range(users)], batch_size=batch_size,
+    )
+    Question.objects.bulk_create(
+        [
+            Question(question_text=f'Benchmark question {i}', pub_date=now - timezone.timedelta(minutes=i))
+            for i in range(questions)
+        ],
+        batch_size=batch_size,
+    )
+    question_ids = list(Question.objects.filter(question_text__startswith='Benchmark question')
+                        .order_by('id').values_list('id', flat=True))
+    Choice.objects.bulk_create(
+        [
+            Choice(question_id=question_id, choice_text=f'Choice {j}')
+            for question_id in question_ids for j in range(choices)
+        ],
+        batch_size=batch_size,
+    )
+    choice_ids = {}
+    for choice_id, question_id in Choice.objects.filter(question_id__in=question_ids).values_list('id', 'question_id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+    user_ids = list(User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True))
+
+    votes = min(votes, len(user_ids) * len(question_ids))
+    pairs = itertools.islice(itertools.product(question_ids, user_ids), votes)
+    batch = []
+    for question_id, user_id in pairs:
+        batch.append(Vote(user_id=user_id, question_id=question_id, choice_id=rng.choice(choice_ids[question_id])))
+        if len(batch) >= batch_size:
+            Vote.objects.bulk_create(batch)
+            batch = []
+    Vote.objects.bulk_create(batch)
+    rebuild_vote_counts()
+    return {'users': len(user_ids), 'questions': len(question_ids), 'choices': len(question_ids) * choices,
+            'votes': votes}
+
+
+def percentile(samples, fraction):
+    """Return the nearest-rank percentile of sorted ``samples``."""
+    if not samples:
+        return None
+    rank = max(math.ceil(fraction * len(samples)) - 1, 0)
+    return samples[rank]
+
+
+def _requests(name, client, question_ids, choice_ids, rng):
+    """Return a callable that makes one request to endpoint ``name``."""
+    def index():
+        return client.get(reverse('polls:index'))
+
+    def detail():
+        return client.get(reverse('polls:detail', args=(rng.choice(question_ids),)))
+
+    def vote():
+        question_id = rng.choice(question_ids)
+        return client.post(reverse('polls:vote', args=(question_id,)), {'choice': rng.choice(choice_ids[question_id])})
+
+    def results():
+        return client.get(reverse('polls:results', args=(rng.choice(question_ids),)))
+
+    return {'index': index, 'detail': detail, 'vote': vote, 'results': results}[name]
+
+
+def run_endpoint(request, requests, warmup):
+    """
+    Measure ``requests`` calls of ``request`` after ``warmup`` untimed calls.
+
+    The query count is taken from one extra call, so that capturing the SQL
+    does not slow down the timed calls.
+    """
+    for _ in range(warmup):
+        request()
+    with CaptureQueriesContext(connection) as captured:
+        status = request().status_code
+    # read the count now, the next request clears the connection's query log
+    queries = len(captured)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        begin = time.perf_counter()
+        request()
+        latencies.append((time.perf_counter() - begin) * 1000)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': requests,
+        'status': status,
+        'queries': queries,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'rps': requests / elapsed if elapsed else None,
+    }
+
+
+def run_benchmark(endpoints=ENDPOINTS, requests=200, warmup=20, rng_seed=0):
+    """
+    Benchmark ``endpoints`` against the data in the database.
+
+    The detail, vote and results pages are requested as a logged in user.
+
+    Returns:
+        dict: The measurements of each endpoint.
+    """
+    rng = random.Random(rng_seed)
+    question_ids = list(Question.objects.filter(choice__isnull=False).distinct().values_list('id', flat=True))
+    choice_ids = {}
+    for choice_id, question_id in Choice.objects.values_list('id', 'question_id'):
+        choice_ids.setdefault(question_id, []).append(choice_id)
+    client = Client()
+    client.force_login(User.objects.order_by('id').first())
+    return {
+        name: run_endpoint(_requests(name, client, question_ids, choice_ids, rng), requests, warmup)
+        for name in endpoints
+    }
+
+
+def environment():
+    """Describe the software the benchmark ran on, for comparing runs."""
+    return {
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'platform': platform.platform(),
+    }
@@ -0,0 +1,115 @@
+"""
+Module for the bulk operations of the admin on many questions at once.
+
+Each operation runs a fixed number of set-based UPDATE, INSERT and DELETE
+queries however many questions it is given, instead of saving them one by
+one.  Because that bypasses ``save()`` and the model signals, each one keeps
+the states, the frozen results and the caches in step itself, once the
+transaction commits.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .listing import invalidate_index
+from .models import Choice, ChoiceCounterShard, Question, QuestionResultSnapshot, Vote, VoteRollup
+from .results import bump_version, freeze_results
+from .routers import pin_primary
+
+
+def _after_commit(question_ids):
+    invalidate_index()
+    for question_id in question_ids:
+        bump_version(question_id)
+
+
+def close_questions(question_ids, now=None):
+    """
+    End the voting of the open and scheduled questions among ``question_ids`` now.
+
+    Returns:
+        int: The number of questions closed.
+    """
+    now = now or timezone.now()
+    with pin_primary(), transaction.atomic():
+        closing = list(
+            Question.objects.filter(pk__in=question_ids).exclude(state=Question.CLOSED).values_list('id', flat=True)
+        )
+        # a scheduled question is published as it closes, so its (empty) results can be seen
+        Question.objects.filter(pk__in=closing, pub_date__gt=now).update(pub_date=now)
+        Question.objects.filter(pk__in=closing).update(end_date=now, state=Question.CLOSED, updated_at=now)
+        freeze_results(closing)
+        transaction.on_commit(lambda: _after_commit(closing))
+    return len(closing)
+
+
+def reopen_questions(question_ids, now=None):
+    """
+    Open the closed questions among ``question_ids`` again, without an end date.
+
+    Questions whose votes were archived are left closed: their Vote rows are
+    gone, so their voters could vote a second time.
+
+    Returns:
+        int: The number of questions reopened.
+    """
+    now = now or timezone.now()
+    with pin_primary(), transaction.atomic():
+        reopening = list(
+            Question.objects.filter(pk__in=question_ids, state=Question.CLOSED, votes_archived_at__isnull=True)
+            .values_list('id', flat=True)
+        )
+        # a closed question has been published (its pub_date is before its end date)
+        Question.objects.filter(pk__in=reopening).update(end_date=None, state=Question.OPEN, updated_at=now)
+        QuestionResultSnapshot.objects.filter(question_id__in=reopening).delete()
+        transaction.on_commit(lambda: _after_commit(reopening))
+    return len(reopening)
+
+
+def duplicate_questions(question_ids, now=None):
+    """
+    Copy each of ``question_ids`` and its choices into a new open question without votes.
+
+    Returns:
+        list: The new questions, in the order of the originals' ids.
+    """
+    now = now or timezone.now()
+    with pin_primary(), transaction.atomic():
+        originals = list(Question.objects.filter(pk__in=question_ids).order_by('id'))
+        copies = Question.objects.bulk_create([
+            Question(question_text=question.question_text, pub_date=now, state=Question.OPEN,
+                     counter_shards=question.counter_shards)
+            for question in originals
+        ])
+        copy_ids = {original.id: copy.id for original, copy in zip(originals, copies)}
+        Choice.objects.bulk_create([
+            Choice(question_id=copy_ids[question_id], choice_text=choice_text)
+            for question_id, choice_text in Choice.objects.filter(question_id__in=copy_ids)
+            .order_by('question_id', 'id').values_list('question_id', 'choice_text')
+        ])
+        transaction.on_commit(lambda: _after_commit([]))
+    return copies
+
+
+def reset_votes(question_ids, now=None):
+    """
+    Delete every vote of ``question_ids`` and set their counters and timelines back to zero.
+
+    The results of closed questions are frozen again, with no votes.
+
+    Returns:
+        int: The number of votes deleted.
+    """
+    now = now or timezone.now()
+    question_ids = list(question_ids)
+    with pin_primary(), transaction.atomic():
+        deleted, _ = Vote.objects.filter(question_id__in=question_ids).delete()
+        Choice.objects.filter(question_id__in=question_ids).exclude(vote_count=0).update(vote_count=0)
+        ChoiceCounterShard.objects.filter(question_id__in=question_ids).delete()
+        VoteRollup.objects.filter(question_id__in=question_ids).delete()
+        Question.objects.filter(pk__in=question_ids).update(updated_at=now, last_vote_at=None)
+        QuestionResultSnapshot.objects.filter(question_id__in=question_ids).delete()
+        freeze_results(list(
+            Question.objects.filter(pk__in=question_ids, state=Question.CLOSED).values_list('id', flat=True)
+        ))
+        transaction.on_commit(lambda: _after_commit(question_ids))
+    return deleted
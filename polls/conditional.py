@@ -0,0 +1,57 @@
+"""
+Module for answering conditional requests to the question pages with 304.
+
+The detail and results pages of a question change only when the question,
+its choices or its state change (``Question.updated_at``) or a vote moves its
+tally (``Question.last_vote_at``), and with the user viewing them.  Their
+``ETag`` is built from those, so a browser revalidating an unchanged page
+gets a 304 Not Modified without the page being rendered.
+
+The detail page also holds the vote form's CSRF token, which changes when
+the user logs in again; its ``ETag`` includes a digest of the CSRF secret so
+that a page with a stale token is never revalidated.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+def page_etag(question_id, last_modified, user_id=None, csrf_secret=None):
+    """
+    Return the ``ETag`` of a question page last modified at ``last_modified``, as seen by ``user_id``.
+
+    A page with a form passes the ``csrf_secret`` its token is derived from.
+    """
+    stamp = int(last_modified.timestamp() * 1_000_000)
+    etag = f'q{question_id}-{stamp}-u{user_id or 0}'
+    if csrf_secret:
+        etag += '-' + hashlib.sha256(csrf_secret.encode()).hexdigest()[:16]
+    return quote_etag(etag)
+
+
+def csrf_secret(request):
+    """Return the CSRF secret of ``request``, creating one (and its cookie) when the client has none."""
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+def not_modified(request, etag, last_modified):
+    """
+    Return a 304 response when the client's copy of the page is current, else None.
+
+    Requests with pending messages always get the full page, which shows them.
+    """
+    if len(get_messages(request)):
+        return None
+    return get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+
+
+def add_validators(response, etag, last_modified):
+    """Set the validators of a page on its response."""
+    if response.status_code == 200:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
@@ -0,0 +1,117 @@
+"""
+Module for the vote counters of the choices, sharded for hot polls.
+
+A vote moves the counter of its choice.  For most questions that is
+``Choice.vote_count``, a single row per choice.  When one question gets most
+of the traffic, every vote for a choice waits for the lock on that row, so a
+question with ``counter_shards`` above 1 spreads its votes over that many
+ChoiceCounterShard rows per choice instead, each vote picking one at random.
+
+The vote count of a choice is its ``vote_count`` plus the votes of its
+shards (``choice_votes``).  ``compact_counters``, run periodically by the
+``compact_vote_counters`` command, folds the shards back into
+``vote_count`` so that they stay small.
+"""
+import random
+
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Choice, ChoiceCounterShard, Question
+from .routers import pin_primary
+
+
+def _shard_sum(**outer):
+    shards = ChoiceCounterShard.objects.filter(**{field: OuterRef(ref) for field, ref in outer.items()})
+    total = shards.order_by().values(*outer).annotate(total=Sum('votes')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def choice_votes():
+    """Return the expression of a Choice's vote count, its counter plus its shards."""
+    return F('vote_count') + _shard_sum(choice_id='pk')
+
+
+def question_votes():
+    """Return the expression of a Question's vote total, for a query on questions."""
+    return Coalesce(Sum('choice__vote_count'), Value(0)) + _shard_sum(question_id='pk')
+
+
+def apply_count_deltas(deltas, shards=None):
+    """
+    Add the changes of choices' vote counts to their counters.
+
+    Args:
+        deltas (dict): Maps (question_id, choice_id) to the change of the choice's vote count.
+        shards (dict): Maps question ids to their ``counter_shards``; read
+            from the database for the questions missing from it.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    shards = dict(shards or {})
+    missing = {question_id for question_id, _ in deltas} - shards.keys()
+    if missing:
+        shards.update(Question.objects.filter(pk__in=missing).values_list('id', 'counter_shards'))
+    unsharded = {}
+    # in choice order, so that concurrent votes lock the rows in the same order
+    for (question_id, choice_id), delta in sorted(deltas.items(), key=lambda item: item[0][1]):
+        if shards.get(question_id, 1) > 1:
+            _add_to_shard(question_id, choice_id, random.randrange(shards[question_id]), delta)
+        else:
+            unsharded[choice_id] = delta
+    if unsharded:
+        # one UPDATE however many choices moved
+        Choice.objects.filter(pk__in=unsharded).update(vote_count=F('vote_count') + _delta_case(unsharded))
+
+
+def _delta_case(deltas):
+    return Case(*(When(pk=choice_id, then=Value(delta)) for choice_id, delta in deltas.items()), default=Value(0))
+
+
+def _add_to_shard(question_id, choice_id, shard, delta):
+    rows = ChoiceCounterShard.objects.filter(choice_id=choice_id, shard=shard)
+    if not rows.update(votes=F('votes') + delta):
+        # the first vote on this shard
+        ChoiceCounterShard.objects.bulk_create(
+            [ChoiceCounterShard(question_id=question_id, choice_id=choice_id, shard=shard)], ignore_conflicts=True,
+        )
+        rows.update(votes=F('votes') + delta)
+
+
+def compact_counters(question_ids=None):
+    """
+    Fold the votes of the counter shards into ``Choice.vote_count``.
+
+    Each question is compacted in a transaction of its own, under a lock on
+    its shard rows.  The emptied rows are kept for the next votes, except
+    those beyond a question's current ``counter_shards`` and those of
+    questions that are no longer sharded.
+
+    Args:
+        question_ids (iterable): Only compact these questions (default: all).
+
+    Returns:
+        int: The net number of votes moved into ``Choice.vote_count``.
+    """
+    shards = ChoiceCounterShard.objects.all()
+    if question_ids is not None:
+        shards = shards.filter(question_id__in=question_ids)
+    moved = 0
+    with pin_primary():
+        for question_id in list(shards.order_by('question_id').values_list('question_id', flat=True).distinct()):
+            with transaction.atomic():
+                rows = list(ChoiceCounterShard.objects.select_for_update().filter(question_id=question_id)
+                            .order_by('id').values_list('id', 'choice_id', 'votes'))
+                totals = {}
+                for _, choice_id, votes in rows:
+                    totals[choice_id] = totals.get(choice_id, 0) + votes
+                totals = {choice_id: total for choice_id, total in totals.items() if total}
+                if totals:
+                    Choice.objects.filter(pk__in=totals).update(vote_count=F('vote_count') + _delta_case(totals))
+                    moved += sum(totals.values())
+                locked = ChoiceCounterShard.objects.filter(pk__in=[row_id for row_id, _, _ in rows])
+                count = Question.objects.filter(pk=question_id).values_list('counter_shards', flat=True).first()
+                # an unsharded question counts in Choice.vote_count and needs no shard at all
+                locked.filter(shard__gte=count if count and count > 1 else 0).delete()
+                locked.exclude(votes=0).update(votes=0)
+    return moved
@@ -0,0 +1,152 @@
+"""
+Module for pushing live tally changes to results subscribers.
+
+Recording a vote publishes the per-choice change of the vote counters to a
+channel (``POLLS_EVENTS_CHANNEL``).  The default InProcessChannel hands it
+straight to this process's Broker; a channel backed by a shared message bus
+(Redis pub/sub, PostgreSQL LISTEN/NOTIFY, ...) can implement the same two
+methods to fan changes out across worker processes.
+
+The Broker lives on the event loop that serves the ``results/stream`` SSE
+connections.  It adds up the changes of each question and pushes at most one
+message per question every ``POLLS_EVENTS_COALESCE_MS`` milliseconds to every
+subscriber, so a burst of votes turns into a single small message.
+"""
+import asyncio
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class InProcessChannel:
+    """Delivers published changes to the listeners of this process only."""
+
+    def __init__(self):
+        self._listeners = []
+
+    def publish(self, question_id, deltas):
+        """Send the counter changes of a question to every listener."""
+        for listener in self._listeners:
+            listener(question_id, deltas)
+
+    def listen(self, callback):
+        """Call ``callback(question_id, deltas)`` for every published change."""
+        self._listeners.append(callback)
+
+
+class Subscriber:
+    """One SSE connection waiting for the changes of a question."""
+
+    def __init__(self, question_id, max_pending=100):
+        self.question_id = question_id
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        # set when messages had to be dropped; the stream then resends the full tally
+        self.resync = False
+
+    def offer(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.resync = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class Broker:
+    """Coalesces tally changes and fans them out to the subscribers of this process."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._loop = None
+        self._subscribers = defaultdict(set)
+        self._pending = {}
+
+    def subscribe(self, question_id):
+        """Register a subscriber on the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop and (self._loop is None or self._loop.is_closed() or not self.subscriber_count()):
+            self._loop = loop
+            self._pending.clear()
+        subscriber = Subscriber(question_id)
+        self._subscribers[question_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscribers = self._subscribers.get(subscriber.question_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.question_id]
+
+    def subscriber_count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def receive(self, question_id, deltas):
+        """Accept a change from the channel; safe to call from any thread."""
+        loop = self._loop
+        if loop is None or loop.is_closed() or question_id not in self._subscribers:
+            return
+        loop.call_soon_threadsafe(self._add, question_id, deltas)
+
+    def _add(self, question_id, deltas):
+        pending = self._pending.get(question_id)
+        if pending is None:
+            pending = self._pending[question_id] = Counter()
+            self._loop.call_later(self.interval, self._flush, question_id)
+        pending.update(deltas)
+
+    def _flush(self, question_id):
+        deltas = {str(choice_id): delta for choice_id, delta in self._pending.pop(question_id, {}).items() if delta}
+        if not deltas:
+            return
+        message = {'question': question_id, 'deltas': deltas}
+        for subscriber in list(self._subscribers.get(question_id, ())):
+            subscriber.offer(message)
+
+
+_lock = threading.RLock()
+_channel = None
+_broker = None
+
+
+def get_channel():
+    """Return the channel of this process, creating it on first use."""
+    global _channel
+    if _channel is None:
+        with _lock:
+            if _channel is None:
+                _channel = import_string(settings.POLLS_EVENTS_CHANNEL)()
+    return _channel
+
+
+def get_broker():
+    """Return the broker of this process, listening on the channel."""
+    global _broker
+    if _broker is None:
+        with _lock:
+            if _broker is None:
+                broker = Broker(settings.POLLS_EVENTS_COALESCE_MS / 1000)
+                get_channel().listen(broker.receive)
+                _broker = broker
+    return _broker
+
+
+def publish_changes(changes):
+    """
+    Publish the counter changes of recorded votes.
+
+    Args:
+        changes (dict): Maps (user_id, question_id) to (old_choice_id, new_choice_id),
+            as returned by ``polls.voting.record_votes``.
+    """
+    per_question = defaultdict(Counter)
+    for (_, question_id), (old_choice_id, new_choice_id) in changes.items():
+        if old_choice_id is not None:
+            per_question[question_id][old_choice_id] -= 1
+        per_question[question_id][new_choice_id] += 1
+    channel = get_channel()
+    for question_id, deltas in per_question.items():
+        channel.publish(question_id, dict(deltas))
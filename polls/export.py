@@ -0,0 +1,87 @@
+"""
+Module for streaming votes and results out as CSV or NDJSON.
+
+Rows are read with ``.iterator(chunk_size=...)`` and written one line at a
+time, so memory stays flat however many votes a poll has.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .counters import choice_votes
+from .models import Choice, Vote
+
+VOTE_FIELDS = ['vote_id', 'user_id', 'username', 'question_id', 'question_text', 'choice_id', 'choice_text']
+RESULT_FIELDS = ['question_id', 'question_text', 'choice_id', 'choice_text', 'votes']
+KINDS = ('votes', 'results')
+FORMATS = ('csv', 'ndjson')
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def vote_rows(question_id=None, chunk_size=2000):
+    """Yield every vote, joined with its user, question and choice, as a dict."""
+    votes = Vote.objects.order_by('id')
+    if question_id is not None:
+        votes = votes.filter(question_id=question_id)
+    rows = votes.values_list(
+        'id', 'user_id', 'user__username', 'question_id', 'question__question_text', 'choice_id', 'choice__choice_text',
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(VOTE_FIELDS, row))
+
+
+def result_rows(question_id=None, chunk_size=2000):
+    """Yield the vote count of every choice, with its question, as a dict."""
+    choices = Choice.objects.order_by('question_id', 'id')
+    if question_id is not None:
+        choices = choices.filter(question_id=question_id)
+    rows = choices.annotate(votes=choice_votes()).values_list(
+        'question_id', 'question__question_text', 'id', 'choice_text', 'votes',
+    )
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield dict(zip(RESULT_FIELDS, row))
+
+
+def rows_for(kind, question_id=None, chunk_size=2000):
+    """Return the field names and the row generator of an export ``kind``."""
+    if kind == 'votes':
+        return VOTE_FIELDS, vote_rows(question_id, chunk_size)
+    return RESULT_FIELDS, result_rows(question_id, chunk_size)
+
+
+class _Echo:
+    """A file-like object that hands back what is written to it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(fields, rows):
+    """Yield a CSV header and one CSV line per row."""
+    writer = csv.DictWriter(_Echo(), fieldnames=fields)
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    """Yield one JSON document per row, each on its own line."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_lines(kind, fmt, question_id=None, chunk_size=2000):
+    """
+    Yield the lines of an export.
+
+    Args:
+        kind (str): 'votes' for raw votes or 'results' for per-choice counts.
+        fmt (str): 'csv' or 'ndjson'.
+        question_id (int): Only export this question.
+        chunk_size (int): Rows fetched from the database at a time.
+    """
+    fields, rows = rows_for(kind, question_id, chunk_size)
+    if fmt == 'csv':
+        return csv_lines(fields, rows)
+    return ndjson_lines(rows)
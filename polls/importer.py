@@ -0,0 +1,185 @@
+"""
+Module for bulk importing polls, choices, users and votes.
+
+Reads the fixture format written by ``manage.py dumpdata`` (the format of
+``data/polls.json`` and ``data/users.json``) or CSV files as a stream and
+inserts the rows with ``bulk_create`` in batches, inside one transaction
+with constraint checks deferred until the end.
+"""
+import csv
+import json
+import time
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .listing import invalidate_index
+from .models import Choice
+from .results import bump_version
+from .routers import pin_primary
+from .states import reset_states
+from .timeline import backfill_rollups
+from .voting import rebuild_vote_counts
+
+MODELS = ('auth.user', 'polls.question', 'polls.choice', 'polls.vote')
+
+
+def iter_json_fixture(fp, chunk_size=1 << 16):
+    """
+    Yield the objects of a JSON fixture (a JSON array) one at a time.
+
+    Only one object and one chunk of the file are held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = fp.read(chunk_size)
+        buffer += chunk
+        pos = 0
+        while True:
+            # skip whitespace, the opening bracket and the commas between objects
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n,[':
+                if buffer[pos] == '[':
+                    started = True
+                pos += 1
+            if pos >= len(buffer) or buffer[pos] == ']':
+                break
+            if not started:
+                raise ValueError("A fixture must be a JSON array.")
+            try:
+                obj, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                break  # the object continues in the next chunk
+            yield obj
+            pos = end
+        buffer = buffer[pos:]
+        if not chunk:
+            return
+
+
+def iter_csv_rows(fp, label):
+    """
+    Yield the rows of a CSV file of ``label`` objects in fixture form.
+
+    The header names the model fields; an ``id`` or ``pk`` column gives the
+    primary key. Empty cells are read as null.
+    """
+    for row in csv.DictReader(fp):
+        pk = row.pop('pk', None) or row.pop('id', None)
+        fields = {name: (value if value != '' else None) for name, value in row.items()}
+        yield {'model': label, 'pk': pk, 'fields': fields}
+
+
+class FixtureImporter:
+    """Buffers fixture objects per model and writes them with ``bulk_create``."""
+
+    def __init__(self, batch_size=5000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.pending = {label: [] for label in MODELS}
+        self.counts = {label: 0 for label in MODELS}
+        self.question_ids = set()
+        self.started = time.monotonic()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def build(self, label, pk, fields):
+        """Return an unsaved instance of ``label`` from fixture fields."""
+        model = apps.get_model(label)
+        values = {}
+        for name, value in fields.items():
+            field = model._meta.get_field(name)
+            if field.many_to_many:
+                continue
+            if field.is_relation:
+                values[field.attname] = field.target_field.to_python(value) if value is not None else None
+            else:
+                values[field.attname] = field.to_python(value)
+        if pk is not None:
+            values[model._meta.pk.attname] = model._meta.pk.to_python(pk)
+        return model(**values)
+
+    def add(self, obj):
+        """Queue one fixture object, writing its model's batch when it is full."""
+        label = obj['model'].lower()
+        if label not in self.pending:
+            raise ValueError(f"Cannot import objects of model '{obj['model']}'.")
+        self.pending[label].append(self.build(label, obj.get('pk'), obj.get('fields', {})))
+        if len(self.pending[label]) >= self.batch_size:
+            self.flush(label)
+
+    def flush(self, label=None):
+        """Write the queued objects of ``label``, or of every model in dependency order."""
+        if label is None:
+            for name in MODELS:
+                self.flush(name)
+            return
+        objects, self.pending[label] = self.pending[label], []
+        if not objects:
+            return
+        if label == 'polls.vote':
+            # votes from fixtures written before Vote.question existed only name the choice
+            self.flush('polls.choice')
+            self._fill_vote_questions(objects)
+        if label == 'polls.question':
+            self.question_ids.update(obj.pk for obj in objects)
+        elif label in ('polls.choice', 'polls.vote'):
+            self.question_ids.update(obj.question_id for obj in objects if obj.question_id is not None)
+        apps.get_model(label).objects.bulk_create(objects, batch_size=self.batch_size)
+        self.counts[label] += len(objects)
+        if self.progress:
+            elapsed = max(time.monotonic() - self.started, 1e-6)
+            self.progress(f"{label}: {self.counts[label]} rows, {self.total / elapsed:.0f} rows/s")
+
+    def _fill_vote_questions(self, votes):
+        missing = {vote.choice_id for vote in votes if vote.question_id is None}
+        if not missing:
+            return
+        questions = dict(Choice.objects.filter(pk__in=missing).values_list('id', 'question_id'))
+        for vote in votes:
+            if vote.question_id is None:
+                vote.question_id = questions.get(vote.choice_id)
+
+
+def import_fixtures(sources, batch_size=5000, progress=None):
+    """
+    Import fixture objects from ``sources`` in a single transaction.
+
+    Args:
+        sources (iterable): Iterables of fixture objects, e.g. from
+            ``iter_json_fixture`` or ``iter_csv_rows``.
+        batch_size (int): Objects written per ``bulk_create``.
+        progress (callable): Called with a progress message after each batch.
+
+    Returns:
+        dict: The number of rows imported per model label.
+    """
+    importer = FixtureImporter(batch_size=batch_size, progress=progress)
+    # the import reads back rows it has just written, which a replica does not have yet
+    with pin_primary(), transaction.atomic():
+        with connection.constraint_checks_disabled():
+            for source in sources:
+                for obj in source:
+                    importer.add(obj)
+            importer.flush()
+        connection.check_constraints()
+        models = [apps.get_model(label) for label, count in importer.counts.items() if count]
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            with connection.cursor() as cursor:
+                cursor.execute(sql)
+        if importer.counts['polls.vote'] or importer.counts['polls.choice']:
+            # bulk_create skips the vote path, so bring the counters and rollups in step once
+            rebuild_vote_counts()
+            backfill_rollups(importer.question_ids)
+        # and Question.save(), which sets the state
+        reset_states(importer.question_ids)
+    invalidate_index()
+    for question_id in importer.question_ids:
+        bump_version(question_id)
+    return importer.counts
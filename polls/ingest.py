@@ -0,0 +1,153 @@
+"""
+Module for the buffered vote ingestion mode.
+
+When ``POLLS_VOTE_INGESTION`` is ``'buffered'`` the vote view only validates a
+vote and hands it to the process-wide VoteBuffer.  A background thread
+flushes the buffer every ``POLLS_VOTE_FLUSH_INTERVAL`` seconds, or as soon as
+``POLLS_VOTE_BATCH_SIZE`` votes are waiting, writing them in bulk through
+``polls.voting.record_votes``.
+"""
+import atexit
+import logging
+import threading
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, close_old_connections
+
+from .models import Choice
+from .voting import record_votes
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """Collects votes in memory and writes them to the database in batches."""
+
+    def __init__(self, batch_size, flush_interval, background=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.background = background
+        # (user_id, question_id) -> choice_id; a later vote replaces an earlier one
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, user_id, question_id, choice_id):
+        """Queue a vote; the latest vote of a user on a question wins."""
+        with self._lock:
+            self._pending[(user_id, question_id)] = choice_id
+            full = len(self._pending) >= self.batch_size
+        self._ensure_started()
+        if full:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Write every queued vote to the database.
+
+        Returns:
+            int: The number of votes that were created or switched.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            written = 0
+            items = iter(pending.items())
+            while True:
+                batch = dict(islice(items, self.batch_size))
+                if not batch:
+                    break
+                try:
+                    written += self._write(batch)
+                except Exception:
+                    self._requeue(batch, items)
+                    raise
+            return written
+
+    def _write(self, batch):
+        """
+        Write a batch, dropping the votes that can never be written.
+
+        Votes whose user, question or choice was deleted since they were queued
+        are dropped before the batch is written.  If the batch is still rejected
+        (one of them was deleted meanwhile) the votes are written one by one,
+        and those rejected again are dropped instead of being queued forever.
+        """
+        batch = _drop_dangling(batch)
+        try:
+            return len(record_votes(batch))
+        except IntegrityError:
+            written = 0
+            for key, choice_id in batch.items():
+                try:
+                    written += len(record_votes({key: choice_id}))
+                except IntegrityError:
+                    logger.warning("Dropped buffered vote %s for choice %s", key, choice_id, exc_info=True)
+            return written
+
+    def _requeue(self, batch, rest):
+        """Put unwritten votes back without overriding newer ones."""
+        with self._lock:
+            for key, choice_id in list(batch.items()) + list(rest):
+                self._pending.setdefault(key, choice_id)
+
+    def _ensure_started(self):
+        if not self.background or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='polls-vote-flusher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush buffered votes")
+            finally:
+                close_old_connections()
+
+
+def _drop_dangling(batch):
+    """Return the votes of ``batch`` whose user and choice (of that question) still exist."""
+    users = set(User.objects.filter(pk__in={user_id for user_id, _ in batch}).values_list('id', flat=True))
+    choices = dict(Choice.objects.filter(pk__in=set(batch.values())).values_list('id', 'question_id'))
+    kept = {}
+    for (user_id, question_id), choice_id in batch.items():
+        if user_id in users and choices.get(choice_id) == question_id:
+            kept[(user_id, question_id)] = choice_id
+        else:
+            logger.warning("Dropped buffered vote %s for choice %s", (user_id, question_id), choice_id)
+    return kept
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the process-wide VoteBuffer, creating it on first use."""
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                _buffer = VoteBuffer(settings.POLLS_VOTE_BATCH_SIZE, settings.POLLS_VOTE_FLUSH_INTERVAL)
+                atexit.register(_buffer.flush)
+    return _buffer
+
+
+def is_buffered():
+    """Return True if votes should go through the buffer."""
+    return settings.POLLS_VOTE_INGESTION == 'buffered'
@@ -0,0 +1,190 @@
+"""
+Module for the cached, paginated listing of published questions shown on the index page.
+
+The listing reads the state column of each question (see ``polls.states``),
+and is cached until the next ``pub_date`` or ``end_date`` boundary, which is
+the earliest moment the list or a state could change by itself.  Editing a
+question invalidates the list through ``invalidate_index``.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.db.models import BooleanField, Case, Min, Q, Value, When
+from django.http import Http404
+
+from .models import Question
+
+_VERSION_KEY = 'polls:index:version'
+_BOUNDARY_KEY = 'polls:index:next-boundary'
+_NEVER = 'never'
+_CURSOR_SALT = 'polls.listing.cursor'
+
+
+def _cache():
+    """Return the cache configured for poll listings."""
+    return caches[settings.POLLS_RESULTS_CACHE]
+
+
+def _version():
+    cache = _cache()
+    version = cache.get(_VERSION_KEY)
+    if version is None:
+        cache.add(_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(_VERSION_KEY)
+    return version
+
+
+def invalidate_index():
+    """Drop every cached listing and the next boundary, e.g. after a question was added or edited."""
+    cache = _cache()
+    try:
+        cache.incr(_VERSION_KEY)
+    except ValueError:
+        cache.add(_VERSION_KEY, time.time_ns(), None)
+    cache.delete(_BOUNDARY_KEY)
+
+
+def _boundaries():
+    return {
+        'next_pub': Min('pub_date', filter=Q(state=Question.SCHEDULED)),
+        'next_end': Min('end_date', filter=Q(state=Question.OPEN)),
+    }
+
+
+def _earliest(boundaries):
+    upcoming = [moment for moment in boundaries.values() if moment is not None]
+    return min(upcoming) if upcoming else _NEVER
+
+
+def next_boundary():
+    """
+    Return the next moment a scheduled question opens or an open question closes.
+
+    The moment is cached until ``invalidate_index``, and at most
+    ``POLLS_INDEX_CACHE_TIMEOUT``: with a per-process cache, the edits made
+    by other processes are only seen once it expires.  Returns None when no
+    question is due to change state.
+    """
+    cache = _cache()
+    boundary = cache.get(_BOUNDARY_KEY)
+    if boundary is None:
+        boundary = _earliest(Question.objects.aggregate(**_boundaries()))
+        cache.set(_BOUNDARY_KEY, boundary, settings.POLLS_INDEX_CACHE_TIMEOUT)
+    return None if boundary == _NEVER else boundary
+
+
+async def anext_boundary():
+    """Async version of ``next_boundary``."""
+    cache = _cache()
+    boundary = await cache.aget(_BOUNDARY_KEY)
+    if boundary is None:
+        boundary = _earliest(await Question.objects.aaggregate(**_boundaries()))
+        await cache.aset(_BOUNDARY_KEY, boundary, settings.POLLS_INDEX_CACHE_TIMEOUT)
+    return None if boundary == _NEVER else boundary
+
+
+def published_questions():
+    """
+    Return the published (open or closed) questions, newest first.
+
+    Each question is annotated with ``is_open``, whether voting is allowed.
+    """
+    return Question.objects.exclude(state=Question.SCHEDULED).annotate(
+        is_open=Case(
+            When(state=Question.OPEN, then=Value(True)),
+            default=Value(False),
+            output_field=BooleanField(),
+        )
+    ).order_by('-pub_date', '-id')
+
+
+def encode_cursor(question):
+    """Return an opaque token pointing just after ``question`` in the listing."""
+    return signing.dumps([question.pub_date.isoformat(), question.id], salt=_CURSOR_SALT)
+
+
+def decode_cursor(token):
+    """
+    Return the (pub_date, id) position encoded in a cursor token.
+
+    Raises:
+        Http404: If the token was not issued by ``encode_cursor``.
+    """
+    try:
+        pub_date, question_id = signing.loads(token, salt=_CURSOR_SALT)
+        return datetime.datetime.fromisoformat(pub_date), int(question_id)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise Http404("Invalid page")
+
+
+def question_page(cursor=None, status=None, page_size=None):
+    """
+    Return one page of the published questions, seeking past ``cursor``.
+
+    The page is read with a single range scan on (pub_date, id) however deep
+    the cursor is, instead of skipping rows with OFFSET.
+
+    Args:
+        cursor (str): A token from a previous page's ``next_cursor``.
+        status (str): 'open' or 'closed' to list only open or closed questions.
+        page_size (int): Questions per page, POLLS_INDEX_PAGE_SIZE by default.
+
+    Returns:
+        dict: ``questions`` on the page and the ``next_cursor`` of the
+        following page, or None on the last page.
+    """
+    page_size = page_size or settings.POLLS_INDEX_PAGE_SIZE
+    questions = published_questions()
+    if status == 'open':
+        questions = questions.filter(state=Question.OPEN)
+    elif status == 'closed':
+        questions = questions.filter(state=Question.CLOSED)
+    if cursor:
+        pub_date, question_id = decode_cursor(cursor)
+        questions = questions.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=question_id))
+    rows = list(questions[:page_size + 1])
+    page = rows[:page_size]
+    return {
+        'questions': page,
+        'next_cursor': encode_cursor(page[-1]) if len(rows) > page_size else None,
+    }
+
+
+def seconds_until_next_boundary(now):
+    """
+    Return the number of seconds from ``now`` until a question is published or closes.
+
+    Returns None when no question is scheduled to change state.
+    """
+    boundary = next_boundary()
+    if boundary is None:
+        return None
+    return (boundary - now).total_seconds()
+
+
+def cached_listing(key, build, now):
+    """
+    Return ``build()`` from the cache, caching it until the next boundary.
+
+    Args:
+        key (str): Identifies the listing, e.g. the page being shown.
+        build (callable): Builds the listing when it is not cached.
+        now (datetime): The time the listing is built for.
+    """
+    cache = _cache()
+    cache_key = f'polls:index:{_version()}:{key}'
+    listing = cache.get(cache_key)
+    if listing is None:
+        listing = build()
+        listing['cache_key'] = cache_key
+        timeout = settings.POLLS_INDEX_CACHE_TIMEOUT
+        remaining = seconds_until_next_boundary(now)
+        if remaining is not None:
+            timeout = min(timeout, remaining)
+        # a boundary closer than a second is not worth caching for
+        if timeout >= 1:
+            cache.set(cache_key, listing, int(timeout))
+    return listing
@@ -0,0 +1,36 @@
+"""Management command that archives and prunes the votes of closed polls."""
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from polls.archive import archivable_questions, archive_question_votes
+
+
+class Command(BaseCommand):
+    """Move the Vote rows of closed questions to compressed NDJSON files."""
+
+    help = (
+        "Write the votes of closed polls to gzip compressed NDJSON files, one per question, "
+        "and delete them from the Vote table. Results keep being served from the frozen snapshots."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default='archive', help="Directory of the archives (default: archive).")
+        parser.add_argument('--question', type=int, action='append', dest='questions',
+                            help="Archive this closed question; repeat for several (default: every closed one).")
+        parser.add_argument('--closed-for', type=int, default=0, metavar='DAYS',
+                            help="Only archive questions closed for at least this many days (default: 0).")
+        parser.add_argument('--no-prune', action='store_false', dest='prune',
+                            help="Write the archives but keep the votes in the Vote table.")
+
+    def handle(self, *args, **options):
+        questions = archivable_questions(timezone.now() - datetime.timedelta(days=options['closed_for']))
+        if options['questions']:
+            questions = questions.filter(pk__in=options['questions'])
+        for question_id in questions.order_by('id').values_list('id', flat=True):
+            try:
+                path, count = archive_question_votes(question_id, options['output_dir'], prune=options['prune'])
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            self.stdout.write(f"Question {question_id}: {count} vote(s) written to {path}")
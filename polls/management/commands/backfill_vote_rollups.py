@@ -0,0 +1,23 @@
+"""Management command that rebuilds the vote timeline rollups from the Vote table."""
+from django.core.management.base import BaseCommand
+
+from polls.timeline import backfill_rollups
+
+
+class Command(BaseCommand):
+    """Rebuild the per-minute, per-hour and per-day VoteRollup rows."""
+
+    help = (
+        "Rebuild the vote timeline rollups from the Vote table, for votes recorded before "
+        "the rollups existed or imported without them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question', type=int, action='append', dest='questions',
+                            help="Only rebuild this question; repeat for several (default: all).")
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help="Rollup rows written per insert (default: 5000).")
+
+    def handle(self, *args, **options):
+        written = backfill_rollups(options['questions'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup row(s)."))
@@ -0,0 +1,55 @@
+"""Management command that benchmarks the polls pages on a seeded test database."""
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from polls.benchmark import ENDPOINTS, environment, run_benchmark, seed
+from polls.routers import pin_primary
+
+
+class Command(BaseCommand):
+    """Seed a throwaway database and measure the index, detail, vote and results pages."""
+
+    help = (
+        "Benchmark the polls pages on a freshly created test database and report latency "
+        "percentiles, requests per second and queries per request as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100, help="Questions to seed (default: 100).")
+        parser.add_argument('--choices', type=int, default=4, help="Choices per question (default: 4).")
+        parser.add_argument('--users', type=int, default=1000, help="Users to seed (default: 1000).")
+        parser.add_argument('--votes', type=int, default=10000, help="Votes to seed (default: 10000).")
+        parser.add_argument('--requests', type=int, default=200, help="Timed requests per endpoint (default: 200).")
+        parser.add_argument('--warmup', type=int, default=20, help="Untimed requests per endpoint (default: 20).")
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, dest='endpoints',
+                            help="Endpoint to benchmark; repeat for several (default: all).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed, for reproducible runs.")
+        parser.add_argument('--output', help="Write the report to this JSON file as well as standard output.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # only the primary is replaced by the test database
+            with pin_primary():
+                seeded = seed(options['questions'], options['choices'], options['users'], options['votes'],
+                              rng_seed=options['seed'])
+                results = run_benchmark(options['endpoints'] or ENDPOINTS, options['requests'],
+                                        options['warmup'], rng_seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report = {
+            'environment': environment(),
+            'parameters': {name: options[name] for name in ('requests', 'warmup', 'seed')},
+            'seeded': seeded,
+            'endpoints': results,
+        }
+        text = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                output.write(text + '\n')
+        self.stdout.write(text)
@@ -0,0 +1,21 @@
+"""Management command that folds the vote counter shards into the choices' counters."""
+from django.core.management.base import BaseCommand
+
+from polls.counters import compact_counters
+
+
+class Command(BaseCommand):
+    """Move the votes of the ChoiceCounterShard rows into ``Choice.vote_count``."""
+
+    help = (
+        "Fold the votes of the counter shards of sharded questions into Choice.vote_count; "
+        "run it periodically (e.g. from cron) so the shards stay small."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--question', type=int, action='append', dest='questions',
+                            help="Only compact this question; repeat for several (default: all).")
+
+    def handle(self, *args, **options):
+        moved = compact_counters(options['questions'])
+        self.stdout.write(self.style.SUCCESS(f"Moved {moved} vote(s) into the choice counters."))
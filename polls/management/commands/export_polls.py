@@ -0,0 +1,26 @@
+"""Management command that streams votes or results to CSV or NDJSON."""
+from django.core.management.base import BaseCommand
+
+from polls.export import FORMATS, KINDS, export_lines
+
+
+class Command(BaseCommand):
+    """Export votes or results without loading them into memory."""
+
+    help = "Stream votes or per-choice results as CSV or NDJSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=KINDS, default='votes', help="What to export (default: votes).")
+        parser.add_argument('--format', choices=FORMATS, default='csv', help="Output format (default: csv).")
+        parser.add_argument('--question', type=int, help="Only export this question id.")
+        parser.add_argument('--output', help="File to write to (default: standard output).")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['kind'], options['format'], options['question'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,49 @@
+"""Management command that bulk imports polls, choices, users and votes."""
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.importer import MODELS, import_fixtures, iter_csv_rows, iter_json_fixture
+
+
+class Command(BaseCommand):
+    """A faster ``loaddata`` for the polls fixtures."""
+
+    help = (
+        "Import polls, choices, users and votes from fixture JSON files (the format of data/polls.json) "
+        "or CSV files with bulk inserts in a single transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help="Fixture .json files or .csv files to import.")
+        parser.add_argument(
+            '--model', choices=MODELS,
+            help="Model of the rows in the CSV files, e.g. polls.vote (required for CSV).",
+        )
+        parser.add_argument('--batch-size', type=int, default=5000, help="Rows inserted per batch (default: 5000).")
+
+    def handle(self, *args, **options):
+        files = []
+        for path in options['files']:
+            if not os.path.exists(path):
+                raise CommandError(f"No such file: {path}")
+            if path.endswith('.csv') and not options['model']:
+                raise CommandError("--model is required to import CSV files.")
+            files.append(path)
+
+        def sources():
+            for path in files:
+                with open(path, newline='', encoding='utf-8') as fp:
+                    if path.endswith('.csv'):
+                        yield iter_csv_rows(fp, options['model'])
+                    else:
+                        yield iter_json_fixture(fp)
+
+        verbosity = options['verbosity']
+        progress = self.stdout.write if verbosity >= 1 else None
+        try:
+            counts = import_fixtures(sources(), batch_size=options['batch_size'], progress=progress)
+        except (ValueError, LookupError) as error:
+            raise CommandError(str(error))
+        summary = ', '.join(f"{count} {label}" for label, count in counts.items() if count)
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary or 'nothing'}."))
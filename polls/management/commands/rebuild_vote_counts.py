@@ -0,0 +1,28 @@
+"""Management command that checks and rebuilds the per-choice vote counters."""
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.voting import rebuild_vote_counts
+
+
+class Command(BaseCommand):
+    """Rebuild ``Choice.vote_count`` from the Vote table."""
+
+    help = "Check the per-choice vote counters against the Vote table and rebuild any that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help="Only report counters that are out of step; exit with an error if any are found.",
+        )
+
+    def handle(self, *args, **options):
+        check_only = options['check']
+        mismatches = rebuild_vote_counts(check_only=check_only)
+        for choice_id, counter, actual in mismatches:
+            self.stdout.write(f"Choice {choice_id}: counter={counter} actual={actual}")
+        if check_only and mismatches:
+            raise CommandError(f"{len(mismatches)} vote counter(s) are out of step.")
+        if check_only:
+            self.stdout.write(self.style.SUCCESS("All vote counters match."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(mismatches)} vote counter(s)."))
@@ -0,0 +1,44 @@
+"""Management command that opens and closes polls at their pub_date and end_date."""
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from polls.listing import next_boundary
+from polls.states import advance_states
+
+
+class Command(BaseCommand):
+    """Move questions between the scheduled, open and closed states as their boundaries pass."""
+
+    help = (
+        "Open scheduled polls at their pub_date and close open polls after their end_date, "
+        "freezing their results, sleeping until the next boundary in between."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Advance the states once and exit.")
+        parser.add_argument('--max-sleep', type=float, default=60,
+                            help="Longest sleep between two runs, in seconds (default: 60).")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                moved = advance_states()
+                for state, question_ids in moved.items():
+                    if question_ids:
+                        self.stdout.write(f"{state}: {', '.join(map(str, question_ids))}")
+                if options['once']:
+                    break
+                time.sleep(self.delay(options['max_sleep']))
+        except KeyboardInterrupt:
+            pass
+
+    @staticmethod
+    def delay(max_sleep):
+        """Return how long to sleep: until just after the next boundary, at most ``max_sleep``."""
+        boundary = next_boundary()
+        if boundary is None:
+            return max_sleep
+        # a question closes once its end_date has passed, not at it
+        return min(max((boundary - timezone.now()).total_seconds(), 0) + 0.01, max_sleep)
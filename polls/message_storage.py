@@ -0,0 +1,28 @@
+"""
+Message storages that only write when there are messages to store or to clear.
+
+Once a page has read its messages, Django's cookie storage deletes the
+messages cookie and its session storage drops their key from the session
+on every response, even when the request had no messages and added none;
+the cookie deletion is a ``Set-Cookie`` header on every page.  These
+storages skip that write.  (The default FallbackStorage only writes back
+to the storages that had messages.)
+"""
+from django.contrib.messages.storage import cookie, session
+
+
+class QuietStorageMixin:
+    """Skips storing when no messages came in with the request and none were added."""
+
+    def update(self, response):
+        if not self._queued_messages and not getattr(self, '_loaded_data', None):
+            return []
+        return super().update(response)
+
+
+class CookieStorage(QuietStorageMixin, cookie.CookieStorage):
+    pass
+
+
+class SessionStorage(QuietStorageMixin, session.SessionStorage):
+    pass
@@ -0,0 +1,159 @@
+"""
+Module for the per-request query and latency metrics.
+
+``RequestMetrics`` collects the SQL query count, database time, template
+render time and wall time of the request being served; the middleware in
+``polls.middleware`` makes it current for the request.  Finished requests
+are folded into per-view histograms that the staff metrics endpoint reports.
+"""
+import contextvars
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_current = contextvars.ContextVar('polls_request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised when a view runs more SQL queries than its budget allows."""
+
+
+class RequestMetrics:
+    """The measurements of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.total_ms = 0.0
+
+    def activate(self):
+        """Make these the metrics of the current request; returns a reset token."""
+        return _current.set(self)
+
+    @staticmethod
+    def deactivate(token):
+        _current.reset(token)
+
+    def server_timing(self):
+        """Return the value of the ``Server-Timing`` header for these metrics."""
+        return (
+            f'db;dur={self.db_ms:.1f};desc="{self.queries} queries", '
+            f'tpl;dur={self.template_ms:.1f};desc="templates", '
+            f'total;dur={self.total_ms:.1f}'
+        )
+
+
+def current_metrics():
+    """Return the metrics of the request being served, or None."""
+    return _current.get()
+
+
+def count_query(execute, sql, params, many, context):
+    """
+    Execute wrapper adding each query and its time to the current request's metrics.
+
+    Installed on every database connection (see ``polls.signals``), so that
+    the queries are counted on whatever thread runs them, e.g. the
+    ``sync_to_async`` thread of an async view, which sees the request's
+    metrics through the context.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    begin = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_ms += (perf_counter() - begin) * 1000
+
+
+class Histogram:
+    """A fixed-bucket histogram; the last bucket counts values above every bound."""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+
+    def as_dict(self):
+        labels = [f'le_{bound}' for bound in self.bounds] + ['inf']
+        return {'buckets': dict(zip(labels, self.counts)), 'sum': round(self.total, 3)}
+
+
+class MetricsRegistry:
+    """Aggregates the metrics of finished requests per view name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, metrics):
+        with self._lock:
+            view = self._views.get(view_name)
+            if view is None:
+                view = self._views[view_name] = {
+                    'count': 0,
+                    'queries': Histogram(QUERY_BUCKETS),
+                    'db_ms': Histogram(LATENCY_BUCKETS_MS),
+                    'template_ms': Histogram(LATENCY_BUCKETS_MS),
+                    'total_ms': Histogram(LATENCY_BUCKETS_MS),
+                }
+            view['count'] += 1
+            view['queries'].observe(metrics.queries)
+            view['db_ms'].observe(metrics.db_ms)
+            view['template_ms'].observe(metrics.template_ms)
+            view['total_ms'].observe(metrics.total_ms)
+
+    def snapshot(self):
+        """Return the histograms of every view as plain data."""
+        with self._lock:
+            return {
+                name: {key: value if key == 'count' else value.as_dict() for key, value in view.items()}
+                for name, view in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+registry = MetricsRegistry()
+
+
+class TimedTemplate(Template):
+    """A Django template that adds its render time to the current request's metrics."""
+
+    def render(self, context=None, request=None):
+        metrics = current_metrics()
+        if metrics is None:
+            return super().render(context, request)
+        begin = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_ms += (perf_counter() - begin) * 1000
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every top-level template render."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
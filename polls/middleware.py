@@ -0,0 +1,151 @@
+"""Middleware for the polls project."""
+import logging
+from contextlib import contextmanager
+from functools import partial
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.utils.functional import SimpleLazyObject
+
+from .auth import get_user
+from .metrics import QueryBudgetExceeded, RequestMetrics, registry
+from .routers import pin_primary
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'polls_primary'
+
+
+class RequestMetricsMiddleware:
+    """
+    Measures the SQL queries, database time, template time and wall time of each request.
+
+    The measurements are sent back in a ``Server-Timing`` header and added to
+    the per-view histograms of ``polls.metrics.registry``.  Views listed in
+    ``POLLS_QUERY_BUDGETS`` that run more queries than their budget are logged,
+    or fail with QueryBudgetExceeded when ``POLLS_QUERY_BUDGET_MODE`` is 'raise'.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with self.measure() as metrics:
+            response = self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        with self.measure() as metrics:
+            response = await self.get_response(request)
+        return self.finish(request, response, metrics)
+
+    @contextmanager
+    def measure(self):
+        """Make a fresh RequestMetrics current; the queries run meanwhile are counted into it (``count_query``)."""
+        metrics = RequestMetrics()
+        token = metrics.activate()
+        begin = perf_counter()
+        try:
+            yield metrics
+        finally:
+            metrics.total_ms = (perf_counter() - begin) * 1000
+            RequestMetrics.deactivate(token)
+
+    def finish(self, request, response, metrics):
+        """Add the Server-Timing header and record the metrics of the view."""
+        response['Server-Timing'] = metrics.server_timing()
+        match = request.resolver_match
+        if match is not None:
+            registry.record(match.view_name, metrics)
+            self.check_budget(match.view_name, metrics)
+        return response
+
+    @staticmethod
+    def check_budget(view_name, metrics):
+        """Report a view that ran more queries than its budget."""
+        budget = settings.POLLS_QUERY_BUDGETS.get(view_name)
+        mode = settings.POLLS_QUERY_BUDGET_MODE
+        if budget is None or mode == 'off' or metrics.queries <= budget:
+            return
+        message = f"{view_name} ran {metrics.queries} queries, over its budget of {budget}."
+        if mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class PrimaryPinningMiddleware:
+    """
+    Reads from the primary database for requests that write and the requests just after them.
+
+    A request with an unsafe method (POST, ...) reads from the primary, so it
+    sees the rows it is about to change, and sets a cookie that pins the
+    browser's next ``POLLS_PRIMARY_PIN_SECONDS`` of requests to the primary
+    too; the results page a vote redirects to then shows the vote even when
+    the replicas lag behind.  Does nothing when no read replica is configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.pinned(request):
+            return self.get_response(request)
+        with pin_primary():
+            response = self.get_response(request)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        if not self.pinned(request):
+            return await self.get_response(request)
+        with pin_primary():
+            response = await self.get_response(request)
+        return self.finish(request, response)
+
+    @staticmethod
+    def writes(request):
+        return request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def pinned(self, request):
+        """Return whether the reads of ``request`` must go to the primary."""
+        if not settings.POLLS_READ_DATABASES:
+            return False
+        return self.writes(request) or PIN_COOKIE in request.COOKIES
+
+    def finish(self, request, response):
+        if self.writes(request):
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.POLLS_PRIMARY_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+class CachedUserAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware that loads ``request.user`` through the in-process user cache.
+
+    A logged in user's requests then skip the query for their user row (see
+    ``polls.auth``).
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        if hasattr(request, 'auser'):
+            request.auser = partial(sync_to_async(get_user), request)
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:55
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_vote_count(apps, schema_editor):
+    """Initialise every choice's counter from the existing votes."""
+    Choice = apps.get_model('polls', 'Choice')
+    choices = Choice.objects.using(schema_editor.connection.alias)
+    for choice in choices.annotate(actual=Count('vote')).filter(actual__gt=0):
+        choices.filter(pk=choice.pk).update(vote_count=choice.actual)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0003_remove_choice_votes_vote'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='vote_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_vote_count, migrations.RunPython.noop),
+    ]
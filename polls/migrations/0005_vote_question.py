@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery
+import django.db.models.deletion
+
+
+def backfill_question(apps, schema_editor):
+    """Copy each vote's question from its choice and drop duplicate votes."""
+    db = schema_editor.connection.alias
+    votes = apps.get_model('polls', 'Vote').objects.using(db)
+    choices = apps.get_model('polls', 'Choice').objects.using(db)
+    votes.update(
+        question=Subquery(choices.filter(pk=OuterRef('choice_id')).values('question_id')[:1])
+    )
+    # a user may have more than one vote on a question from the old racy vote
+    # path; keep the latest one and take the others off the counters
+    duplicates = (
+        votes.values('user_id', 'question_id')
+        .annotate(n=Count('id'), latest=models.Max('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        stale = votes.filter(user_id=row['user_id'], question_id=row['question_id']).exclude(pk=row['latest'])
+        for choice_id in stale.values_list('choice_id', flat=True):
+            choices.filter(pk=choice_id).update(vote_count=F('vote_count') - 1)
+        stale.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('polls', '0004_choice_vote_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(backfill_question, migrations.RunPython.noop),
+    ]
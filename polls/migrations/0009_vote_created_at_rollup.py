@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0008_question_pub_id_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='date voted'),
+        ),
+        migrations.CreateModel(
+            name='VoteRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('bucket', models.DateTimeField(verbose_name='bucket start')),
+                ('votes', models.IntegerField(default=0)),
+                ('choice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.choice')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question', 'granularity', 'bucket'], name='polls_rollup_q_gran_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='voterollup',
+            constraint=models.UniqueConstraint(fields=('choice', 'granularity', 'bucket'), name='polls_rollup_unique_bucket'),
+        ),
+    ]
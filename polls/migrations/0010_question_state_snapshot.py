@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def set_states(apps, schema_editor):
+    """Set the state of the existing questions from their dates."""
+    Question = apps.get_model('polls', 'Question')
+    now = django.utils.timezone.now()
+    Question.objects.using(schema_editor.connection.alias).update(state=models.Case(
+        models.When(pub_date__gt=now, then=models.Value('scheduled')),
+        models.When(end_date__lt=now, then=models.Value('closed')),
+        default=models.Value('open'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0009_vote_created_at_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionResultSnapshot',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='result_snapshot', serialize=False, to='polls.question')),
+                ('total', models.IntegerField()),
+                ('choices', models.JSONField()),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='snapshot time')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='state',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('open', 'Open'), ('closed', 'Closed')], default='open', max_length=9),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['state', 'pub_date', 'id'], name='polls_q_state_pub_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['state', 'end_date'], name='polls_q_state_end_idx'),
+        ),
+        # last, so that no ALTER TABLE follows the data change in the transaction
+        migrations.RunPython(set_states, migrations.RunPython.noop),
+    ]
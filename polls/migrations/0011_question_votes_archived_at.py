@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_question_state_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='votes_archived_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='votes archived'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_question_votes_archived_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='last_vote_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='date of last vote'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='date updated'),
+        ),
+    ]
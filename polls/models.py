@@ -8,14 +8,60 @@ from django.contrib.auth.models import User
 class Question(models.Model):
     """this class represents a poll question in the web application."""
 
+    SCHEDULED = 'scheduled'
+    OPEN = 'open'
+    CLOSED = 'closed'
+    STATES = [(SCHEDULED, 'Scheduled'), (OPEN, 'Open'), (CLOSED, 'Closed')]
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField("date published", default=timezone.now)
     end_date = models.DateTimeField("date ended", null=True)
+    # kept in step with the dates by save() and polls.states
+    state = models.CharField(max_length=9, choices=STATES, default=OPEN)
+    # set when the votes of the closed question were moved to an archive file (see polls.archive)
+    votes_archived_at = models.DateTimeField("votes archived", null=True, blank=True)
+    # when the question, its choices or its state last changed, and when a vote last changed
+    # its tally; together they are the Last-Modified time of its pages
+    updated_at = models.DateTimeField("date updated", auto_now=True)
+    last_vote_at = models.DateTimeField("date of last vote", null=True, blank=True, editable=False)
+    # vote counter rows per choice: more than one spreads the writes of a hot poll (see polls.counters)
+    counter_shards = models.PositiveSmallIntegerField("vote counter shards", default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['pub_date', 'end_date'], name='polls_q_pub_end_idx'),
+            models.Index(fields=['end_date'], name='polls_q_end_idx'),
+            # seek order of the paginated index page
+            models.Index(fields=['pub_date', 'id'], name='polls_q_pub_id_idx'),
+            # the index page filtered by state, and the next boundary of each state
+            models.Index(fields=['state', 'pub_date', 'id'], name='polls_q_state_pub_id_idx'),
+            models.Index(fields=['state', 'end_date'], name='polls_q_state_end_idx'),
+        ]
 
     def __str__(self):
         """Returns a readable string representation of the question content."""
         return self.question_text
 
+    def save(self, *args, **kwargs):
+        """Sets the state from the dates before saving."""
+        self.state = self.state_at(timezone.now())
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'state' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'state']
+        super().save(*args, **kwargs)
+
+    def last_modified(self):
+        """Returns when anything shown on the question's pages last changed."""
+        return max(self.updated_at, self.last_vote_at or self.updated_at)
+
+    def state_at(self, now):
+        """Returns the state the question is in at ``now``."""
+        if self.pub_date > now:
+            return self.SCHEDULED
+        if self.end_date is not None and self.end_date < now:
+            return self.CLOSED
+        return self.OPEN
+
     def was_published_recently(self):
         """Checks if the question was published recently."""
         now = timezone.now()
@@ -37,6 +83,7 @@ class Choice(models.Model):
 
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
+    vote_count = models.IntegerField(default=0)
 
     def __str__(self):
         """Returns a human-readable string representation of the choice."""
@@ -44,12 +91,90 @@ class Choice(models.Model):
 
     @property
     def votes(self):
-        """Return the number of votes for this choice."""
-        count = Vote.objects.filter(choice=self).count()
-        return count
+        """Return the number of votes for this choice, its counter plus its counter shards read in one query."""
+        if self.pk is None:
+            return self.vote_count
+        # polls.counters imports the models
+        from .counters import choice_votes
+        return Choice.objects.filter(pk=self.pk).values_list(choice_votes(), flat=True).get()
+
+
+class ChoiceCounterShard(models.Model):
+    """Votes of a choice of a sharded question, not yet folded into ``Choice.vote_count``."""
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE, related_name='counter_shards')
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'shard'], name='polls_shard_unique_choice_shard'),
+        ]
+
+    def __str__(self):
+        """Returns the choice, shard and votes of the shard."""
+        return f"{self.choice_id}#{self.shard}: {self.votes}"
 
 
 class Vote(models.Model):
     """Records a Vote of a Choice by a User"""
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    created_at = models.DateTimeField("date voted", default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'question'], name='polls_vote_unique_user_question'),
+        ]
+        indexes = [
+            # covers "which choice did this user pick" without reading the table
+            models.Index(fields=['user', 'question', 'choice'], name='polls_vote_user_q_choice_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        """Fills in the question from the choice when it was not given."""
+        if self.question_id is None and self.choice_id is not None:
+            self.question_id = self.choice.question_id
+        super().save(*args, **kwargs)
+
+
+class VoteRollup(models.Model):
+    """The net change of a choice's vote count within one minute, hour or day."""
+
+    GRANULARITIES = [('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')]
+
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=6, choices=GRANULARITIES)
+    bucket = models.DateTimeField("bucket start")
+    votes = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['choice', 'granularity', 'bucket'], name='polls_rollup_unique_bucket'),
+        ]
+        indexes = [
+            # the time series of a question
+            models.Index(fields=['question', 'granularity', 'bucket'], name='polls_rollup_q_gran_idx'),
+        ]
+
+    def __str__(self):
+        """Returns the choice, bucket and net vote change of the rollup."""
+        return f"{self.choice_id} {self.granularity} {self.bucket}: {self.votes:+d}"
+
+
+class QuestionResultSnapshot(models.Model):
+    """The final results of a closed question, frozen when it closed."""
+
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True,
+                                    related_name='result_snapshot')
+    total = models.IntegerField()
+    # [{'id': ..., 'choice_text': ..., 'votes': ...}] in choice id order
+    choices = models.JSONField()
+    taken_at = models.DateTimeField("snapshot time", default=timezone.now)
+
+    def __str__(self):
+        """Returns the question and the time of the snapshot."""
+        return f"{self.question_id} at {self.taken_at}"
@@ -0,0 +1,266 @@
+"""
+Module for computing and caching the results of a poll question.
+
+The results are built into a plain structure (dicts and lists) so that the
+results page and the JSON endpoint render from the same precomputed data
+without touching the ORM from the template.
+
+Results are cached per question under a version number.  Recording a vote
+bumps the version, so the next read misses and rebuilds while every other
+read is served from the cache without a database query.  The rebuild reads
+the primary: a lagging replica could miss the vote that moved the version,
+and its stale results would be cached under the new version.
+
+A closed question's results can no longer change: they are read from the
+QuestionResultSnapshot frozen when it closed, and cached without a timeout.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import Http404
+
+from .counters import choice_votes
+from .models import Choice, Question, QuestionResultSnapshot
+from .routers import pin_primary
+
+_stats_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+def _cache():
+    """Return the cache configured for poll results."""
+    return caches[settings.POLLS_RESULTS_CACHE]
+
+
+def _version_key(question_id):
+    return f'polls:results:version:{question_id}'
+
+
+def _results_key(question_id, version):
+    return f'polls:results:{question_id}:{version}'
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def cache_stats():
+    """Return the hit and miss counters of the results cache in this process."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    """Reset the hit and miss counters of the results cache."""
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+def get_version(question_id):
+    """
+    Return the current results version of a question.
+
+    A missing version is initialised from the clock rather than 1, so results
+    cached under an evicted version can never be mistaken for current ones.
+    """
+    cache = _cache()
+    key = _version_key(question_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(question_ids):
+    """Return the current results versions of many questions, with one cache read when they are all set."""
+    found = _cache().get_many([_version_key(question_id) for question_id in question_ids])
+    return {
+        question_id: found.get(_version_key(question_id)) or get_version(question_id)
+        for question_id in question_ids
+    }
+
+
+def bump_version(question_id):
+    """Invalidate the cached results of a question by moving it to a new version, and return that version."""
+    cache = _cache()
+    key = _version_key(question_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+        return cache.get(key)
+
+
+def _choice_rows(question_id):
+    """Return the queryset of the rows the results of a question are built from."""
+    return Choice.objects.filter(question_id=question_id).order_by('id').annotate(
+        votes=choice_votes(),
+    ).values('id', 'choice_text', 'votes')
+
+
+def results_from_rows(question, choices, frozen_at=None):
+    """Turn a question and its choice rows into the results structure."""
+    total = sum(choice['votes'] for choice in choices)
+    return {
+        'question': {
+            'id': question.id,
+            'question_text': question.question_text,
+        },
+        # when the results of a closed question were frozen, None while it is open
+        'frozen_at': frozen_at,
+        'last_modified': question.last_modified(),
+        'total': total,
+        'choices': [
+            {
+                'id': choice['id'],
+                'choice_text': choice['choice_text'],
+                'votes': choice['votes'],
+                'percentage': round(100 * choice['votes'] / total, 1) if total else 0.0,
+            }
+            for choice in choices
+        ],
+    }
+
+
+def results_from_snapshot(question, snapshot):
+    """Turn a question and its result snapshot into the results structure."""
+    return results_from_rows(question, snapshot.choices, frozen_at=snapshot.taken_at)
+
+
+def _timeout(question):
+    return None if question.state == Question.CLOSED else settings.POLLS_RESULTS_CACHE_TIMEOUT
+
+
+def build_results(question):
+    """
+    Build the results of ``question`` with a single query.
+
+    The results of a closed question come from its snapshot, which is
+    frozen here if it is missing; those of an open one from its choices.
+
+    Args:
+        question (Question): The question to build the results for.
+
+    Returns:
+        dict: The question, its total vote count and every choice with its
+        vote count and percentage of the total.
+    """
+    if question.state == Question.CLOSED:
+        snapshot = QuestionResultSnapshot.objects.filter(question_id=question.id).first()
+        if snapshot is None:
+            # frozen from the current counters, and read back before a replica has the new snapshot
+            with pin_primary():
+                freeze_results([question.id])
+                snapshot = QuestionResultSnapshot.objects.get(question_id=question.id)
+        return results_from_snapshot(question, snapshot)
+    return results_from_rows(question, list(_choice_rows(question.id)))
+
+
+async def abuild_results(question):
+    """Async version of ``build_results``."""
+    if question.state == Question.CLOSED:
+        snapshot = await QuestionResultSnapshot.objects.filter(question_id=question.id).afirst()
+        if snapshot is None:
+            with pin_primary():
+                await sync_to_async(freeze_results)([question.id])
+                snapshot = await QuestionResultSnapshot.objects.aget(question_id=question.id)
+        return results_from_snapshot(question, snapshot)
+    return results_from_rows(question, [row async for row in _choice_rows(question.id)])
+
+
+def freeze_results(question_ids):
+    """
+    Write the result snapshot of each of ``question_ids`` that has none yet.
+
+    Called when questions close; the snapshot keeps their final tally.
+    """
+    if not question_ids:
+        return
+    choices = {question_id: [] for question_id in question_ids}
+    rows = Choice.objects.filter(question_id__in=question_ids).order_by('question_id', 'id').annotate(
+        votes=choice_votes(),
+    ).values_list('question_id', 'id', 'choice_text', 'votes')
+    for question_id, choice_id, choice_text, votes in rows:
+        choices[question_id].append({'id': choice_id, 'choice_text': choice_text, 'votes': votes})
+    QuestionResultSnapshot.objects.bulk_create(
+        [
+            QuestionResultSnapshot(question_id=question_id, choices=rows,
+                                   total=sum(choice['votes'] for choice in rows))
+            for question_id, rows in choices.items()
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def refreeze_results(question_ids):
+    """Replace the snapshots of edited questions, dropping those that are no longer closed."""
+    QuestionResultSnapshot.objects.filter(question_id__in=question_ids).delete()
+    freeze_results(list(
+        Question.objects.filter(pk__in=question_ids, state=Question.CLOSED).values_list('id', flat=True)
+    ))
+
+
+def get_results(question_id):
+    """
+    Return the results of a question, from the cache when possible.
+
+    Raises:
+        Http404: If the question does not exist.
+    """
+    cache = _cache()
+    key = _results_key(question_id, get_version(question_id))
+    results = cache.get(key)
+    if results is not None:
+        _count('hits')
+        return results
+    _count('misses')
+    with pin_primary():
+        try:
+            question = Question.objects.get(pk=question_id)
+        except Question.DoesNotExist:
+            raise Http404("Question does not exist")
+        results = build_results(question)
+    cache.set(key, results, _timeout(question))
+    return results
+
+
+async def aget_version(question_id):
+    """Async version of ``get_version``."""
+    cache = _cache()
+    key = _version_key(question_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_results(question_id):
+    """
+    Async version of ``get_results``, using the async cache and ORM APIs.
+
+    Raises:
+        Http404: If the question does not exist.
+    """
+    cache = _cache()
+    key = _results_key(question_id, await aget_version(question_id))
+    results = await cache.aget(key)
+    if results is not None:
+        _count('hits')
+        return results
+    _count('misses')
+    with pin_primary():
+        try:
+            question = await Question.objects.aget(pk=question_id)
+        except Question.DoesNotExist:
+            raise Http404("Question does not exist")
+        results = await abuild_results(question)
+    await cache.aset(key, results, _timeout(question))
+    return results
@@ -0,0 +1,50 @@
+"""
+Database router that spreads reads over the read replicas.
+
+Writes always go to the primary (``default``).  Reads go to one of the
+aliases in ``POLLS_READ_DATABASES`` unless the current request is pinned to
+the primary, which ``polls.middleware.PrimaryPinningMiddleware`` does for
+requests that write and, through a short-lived cookie, for the requests
+that follow them, so users read their own writes despite replication lag.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+
+PRIMARY = 'default'
+
+_pinned = contextvars.ContextVar('polls_primary_pinned', default=False)
+
+
+def is_pinned():
+    """Return whether the reads of the current context go to the primary."""
+    return _pinned.get()
+
+
+@contextmanager
+def pin_primary():
+    """Send every read made inside the block to the primary."""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    """Routes writes to the primary and reads to a random read replica."""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.POLLS_READ_DATABASES
+        if not replicas or is_pinned():
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # the replicas hold the same data as the primary
+        return True
@@ -0,0 +1,78 @@
+"""Signal receivers that keep the cached poll data in step with edits."""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .auth import forget_user
+from .listing import invalidate_index
+from .metrics import count_query
+from .models import Choice, Question, QuestionResultSnapshot
+from .results import bump_version, refreeze_results
+
+
+@receiver([post_save, post_delete], sender=Question)
+def question_changed(sender, instance, **kwargs):
+    """Invalidates the index listings and the question's results."""
+    invalidate_index()
+    bump_version(instance.id)
+
+
+@receiver(post_save, sender=Question)
+def question_saved(sender, instance, **kwargs):
+    """Freezes the results of a question saved as closed, and drops them when it reopens."""
+    refreeze_results([instance.id])
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def choice_changed(sender, instance, **kwargs):
+    """Invalidates the results of the choice's question and marks the question updated."""
+    Question.objects.filter(pk=instance.question_id).update(updated_at=timezone.now())
+    bump_version(instance.question_id)
+
+
+@receiver(post_save, sender=Choice)
+def choice_saved(sender, instance, **kwargs):
+    """Freezes the results of a closed question again with the edited choice."""
+    refreeze_results([instance.question_id])
+
+
+@receiver(post_delete, sender=Choice)
+def choice_deleted(sender, instance, **kwargs):
+    """Drops the frozen results of the choice's question."""
+    # not frozen again here: the question itself may be being deleted
+    QuestionResultSnapshot.objects.filter(question_id=instance.question_id).delete()
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    """Drops the cached copies of a user whose password, status or details changed."""
+    forget_user(instance.pk)
+
+
+@receiver(user_logged_out)
+def user_logged_out_(sender, request, user, **kwargs):
+    """Drops the cached copies of a user that logged out."""
+    if user is not None:
+        forget_user(user.pk)
+
+
+@receiver(connection_created)
+def install_query_counter(sender, connection, **kwargs):
+    """Counts the queries of each connection into the metrics of the request it serves."""
+    # the wrappers outlive a reconnection
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Applies ``POLLS_SQLITE_PRAGMAS`` to each new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.POLLS_SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
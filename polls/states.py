@@ -0,0 +1,85 @@
+"""
+Module for moving questions between the scheduled, open and closed states.
+
+Each question stores its state in an indexed column, set from its dates when
+it is saved.  ``advance_states`` moves the questions whose ``pub_date`` or
+``end_date`` has passed since, freezing the results of the questions that
+close.  It runs from the ``run_poll_scheduler`` command and, lazily, from
+the views once the next boundary (cached by ``polls.listing``) has passed.
+
+Without the scheduler, a process with its own cache only sees the boundaries
+of questions edited by other processes once its cached boundary expires
+(``POLLS_INDEX_CACHE_TIMEOUT``), so the vote views also check the dates of
+the question against the clock.
+"""
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Case, Q, Value, When
+from django.utils import timezone
+
+from .listing import anext_boundary, invalidate_index, next_boundary
+from .models import Question
+from .results import bump_version, freeze_results
+from .routers import pin_primary
+
+
+def state_expression(now):
+    """Return the SQL expression of the state a question is in at ``now``."""
+    return Case(
+        When(pub_date__gt=now, then=Value(Question.SCHEDULED)),
+        When(end_date__lt=now, then=Value(Question.CLOSED)),
+        default=Value(Question.OPEN),
+    )
+
+
+def advance_states(now=None):
+    """
+    Move every question whose boundary has passed at ``now`` to its new state.
+
+    Returns:
+        dict: The ids of the questions that moved, per new state.
+    """
+    now = now or timezone.now()
+    due = Q(state=Question.SCHEDULED, pub_date__lte=now) | (Q(end_date__lt=now) & ~Q(state=Question.CLOSED))
+    moved = {Question.OPEN: [], Question.CLOSED: []}
+    with pin_primary(), transaction.atomic():
+        question_ids = list(Question.objects.select_for_update().filter(due).values_list('id', flat=True))
+        if question_ids:
+            Question.objects.filter(pk__in=question_ids).update(state=state_expression(now), updated_at=now)
+            for question_id, state in Question.objects.filter(pk__in=question_ids).values_list('id', 'state'):
+                moved.setdefault(state, []).append(question_id)
+            freeze_results(moved[Question.CLOSED])
+        transaction.on_commit(lambda: _after_advance(question_ids))
+    return moved
+
+
+def reset_states(question_ids, now=None):
+    """Set the states of questions written without ``save()``, e.g. by bulk inserts, from their dates."""
+    now = now or timezone.now()
+    Question.objects.filter(pk__in=question_ids).update(state=state_expression(now), updated_at=now)
+    freeze_results(list(
+        Question.objects.filter(pk__in=question_ids, state=Question.CLOSED).values_list('id', flat=True)
+    ))
+
+
+def _after_advance(question_ids):
+    # also forgets the next boundary, which has passed
+    invalidate_index()
+    for question_id in question_ids:
+        bump_version(question_id)
+
+
+def ensure_current(now=None):
+    """Advance the states when the next boundary has passed; a cache read otherwise."""
+    now = now or timezone.now()
+    boundary = next_boundary()
+    if boundary is not None and boundary <= now:
+        advance_states(now)
+
+
+async def aensure_current(now=None):
+    """Async version of ``ensure_current``."""
+    now = now or timezone.now()
+    boundary = await anext_boundary()
+    if boundary is not None and boundary <= now:
+        await sync_to_async(advance_states)(now)
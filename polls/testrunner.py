@@ -0,0 +1,11 @@
+"""Test runner for the polls project."""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class QueryBudgetTestRunner(DiscoverRunner):
+    """Runs the tests with query budgets enforced, so a view over its budget fails its test."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.POLLS_QUERY_BUDGET_MODE = 'raise'
@@ -1,9 +1,54 @@
+import asyncio
 import datetime
-from django.test import TestCase
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.signals import request_started
+from django.core.management import call_command
+from django.contrib.messages import constants
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.sessions.backends.db import SessionStore
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
+from django.utils.crypto import get_random_string
 from django.urls import reverse
-from .models import Question, Choice
+from . import async_views, voteindex, voting
+from .asgi import CancelOnDisconnect
+from .models import Question, Choice, ChoiceCounterShard, QuestionResultSnapshot, Vote, VoteRollup
+from .benchmark import run_benchmark, seed
+from .counters import compact_counters, question_votes
+from .events import Broker, get_broker, publish_changes
+from .importer import import_fixtures, iter_csv_rows, iter_json_fixture
+from .ingest import VoteBuffer
+from .listing import next_boundary, seconds_until_next_boundary
+from .message_storage import CookieStorage as QuietCookieStorage
+from .metrics import QueryBudgetExceeded, registry
+from .middleware import PIN_COOKIE
+from .results import (
+    abuild_results, aget_results, build_results, bump_version, cache_stats, get_results, reset_cache_stats,
+)
+from .routers import PrimaryReplicaRouter, pin_primary
+from .states import advance_states, ensure_current
+from .timeline import bucket_start
+from .voting import rebuild_vote_counts, record_vote, record_votes
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from mysite.views import asignup
 
 
 class QuestionModelTests(TestCase):
@@ -94,6 +139,12 @@ def create_question(question_text, days):
 
 
 class QuestionIndexViewTests(TestCase):
+    def setUp(self):
+        """
+        Start every test with an empty listing cache.
+        """
+        cache.clear()
+
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -255,3 +306,1600 @@ class VoteAuthenticationTestCase(TestCase):
         self.assertIn(response1.status_code, [200, 302])
         response2 = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice1.id})
         self.assertEqual(response2.status_code, 302)
+
+
+class VoteCounterTests(TestCase):
+    """
+    Test case for the denormalized per-choice vote counters.
+    """
+
+    def setUp(self):
+        """
+        Set up a user, a question and two choices.
+        """
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+        self.client.login(username='Vader', password='@Iamyourfater')
+
+    def vote_for(self, choice):
+        """Post a vote for ``choice`` as the logged in user."""
+        return self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': choice.id})
+
+    def test_new_vote_increments_counter(self):
+        """
+        Voting for a choice adds one to its counter.
+        """
+        self.vote_for(self.choice1)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 1)
+
+    def test_switch_vote_moves_counter(self):
+        """
+        Changing a vote moves the count from the old choice to the new one.
+        """
+        self.vote_for(self.choice1)
+        self.vote_for(self.choice2)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 0)
+        self.assertEqual(self.choice2.votes, 1)
+
+    def test_repeat_vote_does_not_double_count(self):
+        """
+        Voting for the same choice twice counts once.
+        """
+        self.vote_for(self.choice1)
+        self.vote_for(self.choice1)
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 1)
+
+    def test_rebuild_vote_counts(self):
+        """
+        rebuild_vote_counts repairs counters that drifted from the Vote table.
+        """
+        self.vote_for(self.choice1)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=7)
+        self.assertEqual(rebuild_vote_counts(check_only=True), [(self.choice1.id, 7, 1)])
+        rebuild_vote_counts()
+        self.choice1.refresh_from_db()
+        self.assertEqual(self.choice1.votes, 1)
+        self.assertEqual(rebuild_vote_counts(check_only=True), [])
+
+    def test_rebuild_changes_results_page(self):
+        """
+        After counters are repaired, the results page is sent again with the repaired tally instead of a 304.
+        """
+        self.vote_for(self.choice1)
+        Choice.objects.filter(pk=self.choice1.pk).update(vote_count=7)
+        bump_version(self.question.id)
+        url = reverse('polls:results', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertContains(response, '<td>7</td>')
+        rebuild_vote_counts()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<td>7</td>')
+        self.assertContains(response, '<td>1</td>')
+
+
+class ResultsTests(TestCase):
+    """
+    Test case for the precomputed results of a question.
+    """
+
+    def setUp(self):
+        """
+        Set up a question with two choices and three votes.
+        """
+        cache.clear()
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+        for i in range(3):
+            user = User.objects.create_user(username=f'user{i}', password='@Iamyourfater')
+            record_vote(user, self.question, self.choice1 if i < 2 else self.choice2)
+
+    def test_results_json(self):
+        """
+        The JSON endpoint returns every choice with its votes, percentage and the total.
+        """
+        response = self.client.get(reverse('polls:results_json', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(
+            [(c['choice_text'], c['votes'], c['percentage']) for c in data['choices']],
+            [('Choice 1', 2, 66.7), ('Choice 2', 1, 33.3)],
+        )
+
+    def test_results_json_missing_question(self):
+        """
+        The JSON endpoint returns 404 for a question that does not exist.
+        """
+        response = self.client.get(reverse('polls:results_json', args=(self.question.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+    def test_results_page_uses_precomputed_results(self):
+        """
+        The results page renders from the precomputed results structure.
+        """
+        response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual(response.context['results']['total'], 3)
+        self.assertContains(response, '66.7%')
+
+
+class ResultsCacheTests(TestCase):
+    """
+    Test case for the versioned results cache.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and a question with two choices, with an empty cache.
+        """
+        cache.clear()
+        reset_cache_stats()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+
+    def test_cached_read_uses_no_queries(self):
+        """
+        Reading results a second time is served from the cache without a query.
+        """
+        get_results(self.question.id)
+        with self.assertNumQueries(0):
+            results = get_results(self.question.id)
+        self.assertEqual(results['total'], 0)
+        self.assertEqual(cache_stats(), {'hits': 1, 'misses': 1})
+
+    def test_vote_invalidates_cached_results(self):
+        """
+        Recording a vote makes the next read see the new tally.
+        """
+        get_results(self.question.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question, self.choice1)
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.user, self.question, self.choice2)
+        results = get_results(self.question.id)
+        self.assertEqual([c['votes'] for c in results['choices']], [0, 1])
+        self.assertEqual(cache_stats()['misses'], 3)
+
+    def test_missing_question_results_page(self):
+        """
+        The results page returns 404 for a question that does not exist.
+        """
+        response = self.client.get(reverse('polls:results', args=(self.question.id + 1,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class VoteBufferTests(TestCase):
+    """
+    Test case for the buffered vote ingestion mode.
+    """
+
+    def setUp(self):
+        """
+        Set up two users, a question with two choices and a foreground buffer.
+        """
+        self.user1 = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.user2 = User.objects.create_user(username='Luke', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+        self.buffer = VoteBuffer(batch_size=1, flush_interval=60, background=False)
+
+    def test_last_write_wins(self):
+        """
+        Only the latest buffered vote of a user on a question is written.
+        """
+        self.buffer.submit(self.user1.id, self.question.id, self.choice1.id)
+        self.buffer.submit(self.user1.id, self.question.id, self.choice2.id)
+        self.buffer.submit(self.user2.id, self.question.id, self.choice2.id)
+        self.assertEqual(len(self.buffer), 2)
+        self.assertEqual(self.buffer.flush(), 2)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(Vote.objects.get(user=self.user1).choice, self.choice2)
+        self.choice2.refresh_from_db()
+        self.assertEqual(self.choice2.votes, 2)
+
+    def test_flush_switches_existing_vote(self):
+        """
+        A buffered vote switches a vote that was already written.
+        """
+        record_vote(self.user1, self.question, self.choice1)
+        self.buffer.submit(self.user1.id, self.question.id, self.choice2.id)
+        self.buffer.flush()
+        self.assertEqual(Vote.objects.filter(user=self.user1).count(), 1)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (0, 1))
+
+    def test_flush_drops_vote_of_deleted_choice(self):
+        """
+        A vote whose choice was deleted is dropped; the rest of the batch is written.
+        """
+        self.buffer.batch_size = 10
+        doomed = Choice.objects.create(question=self.question, choice_text='Choice 3')
+        self.buffer.submit(self.user1.id, self.question.id, doomed.id)
+        self.buffer.submit(self.user2.id, self.question.id, self.choice2.id)
+        doomed.delete()
+        with self.assertLogs('polls.ingest', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(list(Vote.objects.values_list('user_id', 'choice_id')), [(self.user2.id, self.choice2.id)])
+
+    def test_flush_writes_rejected_batch_row_by_row(self):
+        """
+        When the database rejects a batch, its votes are written one by one and the rejected one is dropped.
+        """
+        self.buffer.batch_size = 10
+        self.buffer.submit(self.user1.id, self.question.id, self.choice1.id)
+        self.buffer.submit(self.user2.id, self.question.id, self.choice2.id)
+
+        def reject_user1(votes):
+            if (self.user1.id, self.question.id) in votes:
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return record_votes(votes)
+
+        with mock.patch('polls.ingest.record_votes', side_effect=reject_user1), \
+                self.assertLogs('polls.ingest', 'WARNING'):
+            self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(list(Vote.objects.values_list('user_id', 'choice_id')), [(self.user2.id, self.choice2.id)])
+
+    @override_settings(POLLS_VOTE_INGESTION='buffered')
+    def test_vote_view_queues_vote(self):
+        """
+        In buffered mode the vote view queues the vote instead of writing it.
+        """
+        self.client.login(username='Vader', password='@Iamyourfater')
+        with mock.patch('polls.views.get_vote_buffer', return_value=self.buffer):
+            response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice1.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Vote.objects.exists())
+        self.buffer.flush()
+        self.assertEqual(Vote.objects.get(user=self.user1).choice, self.choice1)
+
+
+class VoteUniquenessTests(TestCase):
+    """
+    Test case for the one-vote-per-question constraint and the upsert vote path.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and a question with two choices.
+        """
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+
+    def test_vote_question_filled_from_choice(self):
+        """
+        A Vote saved without a question takes it from its choice.
+        """
+        vote = Vote.objects.create(user=self.user, choice=self.choice1)
+        self.assertEqual(vote.question, self.question)
+
+    def test_duplicate_vote_rejected(self):
+        """
+        The database rejects a second vote by the same user on a question.
+        """
+        Vote.objects.create(user=self.user, choice=self.choice1)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Vote.objects.create(user=self.user, choice=self.choice2)
+
+    def test_record_vote_returns_previous_choice(self):
+        """
+        record_vote upserts the vote and returns the previously selected choice.
+        """
+        self.assertIsNone(record_vote(self.user, self.question, self.choice1))
+        self.assertEqual(record_vote(self.user, self.question, self.choice2), self.choice1.id)
+        self.assertEqual(Vote.objects.get(user=self.user, question=self.question).choice, self.choice2)
+
+    def test_concurrent_first_vote_counted_once(self):
+        """
+        A first vote that finds the vote of a concurrent first vote committed meanwhile switches it.
+        """
+        record_vote(self.user, self.question, self.choice1)
+        reads = []
+
+        def missed_first_read(keys):
+            # the first read ran before the concurrent vote was committed
+            reads.append(keys)
+            return {} if len(reads) == 1 else locked_selections(keys)
+
+        locked_selections = voting._locked_selections
+        with mock.patch('polls.voting._locked_selections', side_effect=missed_first_read):
+            self.assertEqual(record_vote(self.user, self.question, self.choice2), self.choice1.id)
+        self.assertEqual(len(reads), 2)
+        self.assertEqual(Vote.objects.get(user=self.user, question=self.question).choice, self.choice2)
+        self.choice1.refresh_from_db()
+        self.choice2.refresh_from_db()
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (0, 1))
+
+
+class IndexListingCacheTests(TestCase):
+    """
+    Test case for the cached index listing.
+    """
+
+    def setUp(self):
+        """
+        Start every test with an empty listing cache.
+        """
+        cache.clear()
+
+    def test_open_status_computed_in_query(self):
+        """
+        Each listed question carries its open/closed status from the query.
+        """
+        open_question = create_question(question_text="Open question.", days=-2)
+        closed_question = create_question(question_text="Closed question.", days=-2)
+        closed_question.end_date = timezone.now() - datetime.timedelta(days=1)
+        closed_question.save()
+        response = self.client.get(reverse('polls:index'))
+        status = {q.id: q.is_open for q in response.context['latest_question_list']}
+        self.assertEqual(status, {open_question.id: True, closed_question.id: False})
+
+    def test_listing_served_from_cache(self):
+        """
+        A second request between boundaries reads the listing without querying questions.
+        """
+        create_question(question_text="Past question.", days=-30)
+        self.client.get(reverse('polls:index'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('polls:index'))
+
+    def test_new_question_invalidates_listing(self):
+        """
+        Adding a question shows it on the next request.
+        """
+        self.client.get(reverse('polls:index'))
+        question = create_question(question_text="Past question.", days=-1)
+        response = self.client.get(reverse('polls:index'))
+        self.assertEqual(list(response.context['latest_question_list']), [question])
+
+    def test_seconds_until_next_boundary(self):
+        """
+        The listing expires when the next question is published.
+        """
+        now = timezone.now()
+        create_question(question_text="Future question.", days=1)
+        remaining = seconds_until_next_boundary(now)
+        self.assertAlmostEqual(remaining, 86400, delta=5)
+
+
+@override_settings(POLLS_INDEX_PAGE_SIZE=2)
+class IndexPaginationTests(TestCase):
+    """
+    Test case for the keyset pagination of the index page.
+    """
+
+    def setUp(self):
+        """
+        Set up five past questions, the oldest of which is closed.
+        """
+        cache.clear()
+        self.questions = [create_question(question_text=f"Question {i}.", days=-i) for i in range(1, 6)]
+        self.questions[-1].end_date = timezone.now() - datetime.timedelta(hours=1)
+        self.questions[-1].save()
+
+    def test_pages_follow_cursor(self):
+        """
+        Following next_cursor walks through every question exactly once, newest first.
+        """
+        seen = []
+        url = reverse('polls:index')
+        response = self.client.get(url)
+        while True:
+            seen.extend(response.context['latest_question_list'])
+            cursor = response.context['next_cursor']
+            if not cursor:
+                break
+            response = self.client.get(url, {'cursor': cursor})
+        self.assertEqual(seen, self.questions)
+
+    def test_status_filter(self):
+        """
+        The closed filter lists only questions whose end date has passed.
+        """
+        response = self.client.get(reverse('polls:index_json'), {'status': 'closed'})
+        data = response.json()
+        self.assertEqual([q['id'] for q in data['questions']], [self.questions[-1].id])
+        self.assertIsNone(data['next_cursor'])
+
+    def test_index_json(self):
+        """
+        The JSON listing returns a page of questions and the cursor of the next one.
+        """
+        data = self.client.get(reverse('polls:index_json')).json()
+        self.assertEqual([q['id'] for q in data['questions']], [q.id for q in self.questions[:2]])
+        data = self.client.get(reverse('polls:index_json'), {'cursor': data['next_cursor']}).json()
+        self.assertEqual([q['id'] for q in data['questions']], [q.id for q in self.questions[2:4]])
+
+    def test_invalid_cursor(self):
+        """
+        A cursor that was not issued by the listing returns 404.
+        """
+        response = self.client.get(reverse('polls:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    """
+    Test case for the streaming vote and results export.
+    """
+
+    def setUp(self):
+        """
+        Set up a staff user and a question with one vote.
+        """
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater', is_staff=True)
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        record_vote(self.user, self.question, self.choice)
+
+    def test_export_requires_staff(self):
+        """
+        Anonymous users are sent to the login page instead of getting the export.
+        """
+        response = self.client.get(reverse('polls:export', args=('votes', 'csv')))
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_votes_csv(self):
+        """
+        Staff can stream the votes as CSV.
+        """
+        self.client.login(username='Vader', password='@Iamyourfater')
+        response = self.client.get(reverse('polls:export', args=('votes', 'csv')))
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'vote_id,user_id,username,question_id,question_text,choice_id,choice_text')
+        self.assertEqual(lines[1].split(',')[2:], ['Vader', str(self.question.id), 'Test Question',
+                                                   str(self.choice.id), 'Choice 1'])
+
+    def test_export_unknown_format(self):
+        """
+        An unknown export format returns 404.
+        """
+        self.client.login(username='Vader', password='@Iamyourfater')
+        response = self.client.get(reverse('polls:export', args=('votes', 'xml')))
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_command_results_ndjson(self):
+        """
+        The export_polls command writes one JSON document per choice.
+        """
+        out = StringIO()
+        call_command('export_polls', kind='results', format='ndjson', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(rows, [{'question_id': self.question.id, 'question_text': 'Test Question',
+                                 'choice_id': self.choice.id, 'choice_text': 'Choice 1', 'votes': 1}])
+
+
+class ImportPollsTests(TestCase):
+    """
+    Test case for the bulk fixture import.
+    """
+
+    def test_import_bundled_fixtures(self):
+        """
+        import_polls loads the bundled users and polls fixtures with consistent counters.
+        """
+        out = StringIO()
+        call_command('import_polls', 'data/users.json', 'data/polls.json', batch_size=10, stdout=out)
+        self.assertEqual(Question.objects.count(), 5)
+        self.assertEqual(Choice.objects.count(), 25)
+        vote = Vote.objects.get()
+        self.assertEqual(vote.question_id, vote.choice.question_id)
+        self.assertEqual(vote.choice.votes, 1)
+        self.assertIn('rows/s', out.getvalue())
+        self.assertEqual(rebuild_vote_counts(check_only=True), [])
+
+    def test_streaming_parser_across_chunks(self):
+        """
+        Objects split across read chunks are still parsed.
+        """
+        objects = [{'model': 'polls.question', 'pk': i, 'fields': {'question_text': 'q' * i}} for i in range(1, 20)]
+        fp = StringIO(json.dumps(objects, indent=2))
+        self.assertEqual(list(iter_json_fixture(fp, chunk_size=7)), objects)
+
+    def test_import_csv_votes_without_question(self):
+        """
+        CSV votes that only name a choice get their question from the choice.
+        """
+        user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        question = Question.objects.create(question_text='Test Question')
+        choice = Choice.objects.create(question=question, choice_text='Choice 1')
+        rows = StringIO(f"id,user,choice\n1,{user.id},{choice.id}\n")
+        import_fixtures([iter_csv_rows(rows, 'polls.vote')])
+        self.assertEqual(Vote.objects.get().question, question)
+        choice.refresh_from_db()
+        self.assertEqual(choice.votes, 1)
+
+
+class BenchmarkTests(TestCase):
+    """
+    Test case for the benchmark harness.
+    """
+
+    def test_seed_and_run(self):
+        """
+        seed creates the requested volumes and run_benchmark reports every endpoint.
+        """
+        cache.clear()
+        seeded = seed(questions=3, choices=2, users=4, votes=10)
+        self.assertEqual(seeded, {'users': 4, 'questions': 3, 'choices': 6, 'votes': 10})
+        self.assertEqual(Vote.objects.count(), 10)
+        self.assertEqual(rebuild_vote_counts(check_only=True), [])
+        report = run_benchmark(requests=3, warmup=1)
+        self.assertEqual(set(report), {'index', 'detail', 'vote', 'results'})
+        self.assertEqual(report['vote']['status'], 302)
+        self.assertGreater(report['detail']['queries'], 0)
+        self.assertLessEqual(report['results']['p50_ms'], report['results']['p99_ms'])
+
+
+class RequestMetricsTests(TestCase):
+    """
+    Test case for the per-request metrics middleware.
+    """
+
+    def setUp(self):
+        """
+        Start with empty caches and histograms.
+        """
+        cache.clear()
+        registry.reset()
+
+    def test_server_timing_header(self):
+        """
+        Every response reports its query count and timings in Server-Timing.
+        """
+        create_question(question_text="Past question.", days=-1)
+        response = self.client.get(reverse('polls:index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+;')
+
+    def test_metrics_endpoint(self):
+        """
+        The staff metrics endpoint reports per-view histograms.
+        """
+        User.objects.create_user(username='Vader', password='@Iamyourfater', is_staff=True)
+        self.client.get(reverse('polls:index'))
+        self.client.get(reverse('polls:index'))
+        self.client.login(username='Vader', password='@Iamyourfater')
+        views = self.client.get(reverse('polls:metrics')).json()['views']
+        self.assertEqual(views['polls:index']['count'], 2)
+        self.assertEqual(sum(views['polls:index']['total_ms']['buckets'].values()), 2)
+        self.assertGreater(views['polls:index']['template_ms']['sum'], 0)
+
+    async def test_async_request_counts_queries(self):
+        """
+        Served through ASGI, the queries an async view runs on the sync_to_async thread are counted too.
+        """
+        question = await sync_to_async(create_question)(question_text="Past question.", days=-1)
+        response = await AsyncClient().get(reverse('polls:results', args=(question.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('desc="0 queries"', response['Server-Timing'])
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="[1-9]\d* queries"')
+
+    @override_settings(POLLS_QUERY_BUDGETS={'polls:index': 0})
+    def test_query_budget_exceeded(self):
+        """
+        A view that runs more queries than its budget fails in tests.
+        """
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(reverse('polls:index'))
+
+
+class AsyncViewTests(TestCase):
+    """
+    Test case for the async vote, detail and results views.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and a question with two choices.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+
+    def make_request(self, method, path, data=None):
+        """Build an async request from the logged in user with a session and messages."""
+        request = getattr(AsyncRequestFactory(), method)(path, data or {})
+        request.user = self.user
+        request.session = SessionStore()
+        request._messages = FallbackStorage(request)
+        return request
+
+    async def test_async_vote(self):
+        """
+        The async vote view records the vote and redirects to the results.
+        """
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = await async_views.vote(self.make_request('post', url, {'choice': self.choice2.id}), self.question.id)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse('polls:results', args=(self.question.id,)))
+        vote = await Vote.objects.aget(user=self.user, question=self.question)
+        self.assertEqual(vote.choice_id, self.choice2.id)
+
+    async def test_async_vote_without_choice(self):
+        """
+        The async vote view shows the question again when no choice was selected.
+        """
+        url = reverse('polls:vote', args=(self.question.id,))
+        response = await async_views.vote(self.make_request('post', url), self.question.id)
+        await sync_to_async(response.render)()
+        self.assertContains(response, 'Choice 1')
+        self.assertEqual(await Vote.objects.acount(), 0)
+
+    async def test_async_detail_shows_previous_vote(self):
+        """
+        The async detail view selects the choice the user voted for.
+        """
+        await sync_to_async(record_vote)(self.user, self.question, self.choice2)
+        view = async_views.DetailView.as_view()
+        response = await view(self.make_request('get', '/'), pk=self.question.id)
+        await sync_to_async(response.render)()
+        self.assertEqual(response.context_data['user_vote'].choice_id, self.choice2.id)
+        self.assertContains(response, 'Choice 2')
+
+    async def test_async_results(self):
+        """
+        The async results view renders the cached results.
+        """
+        await sync_to_async(record_vote)(self.user, self.question, self.choice1)
+        view = async_views.ResultsView.as_view()
+        response = await view(self.make_request('get', '/'), pk=self.question.id)
+        await sync_to_async(response.render)()
+        self.assertEqual(response.context_data['results']['total'], 1)
+        self.assertContains(response, '100.0%')
+
+
+class LiveResultsTests(TestCase):
+    """
+    Test case for pushing tally changes to live results subscribers.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and a question with two choices.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+
+    async def test_broker_coalesces_changes(self):
+        """
+        Changes arriving within the coalescing interval are sent as one message.
+        """
+        broker = Broker(interval=0.05)
+        subscriber = broker.subscribe(self.question.id)
+        await sync_to_async(broker.receive, thread_sensitive=False)(self.question.id, {self.choice1.id: 1})
+        broker.receive(self.question.id, {self.choice1.id: 1, self.choice2.id: -1})
+        message = await asyncio.wait_for(subscriber.queue.get(), 1)
+        self.assertEqual(message, {'question': self.question.id,
+                                   'deltas': {str(self.choice1.id): 2, str(self.choice2.id): -1}})
+        self.assertTrue(subscriber.queue.empty())
+
+    async def test_results_stream(self):
+        """
+        The stream sends a snapshot, then a tally event for each recorded vote.
+        """
+        request = AsyncRequestFactory().get(reverse('polls:results_stream', args=(self.question.id,)))
+        response = await async_views.results_stream(request, pk=self.question.id)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        snapshot = await anext(stream)
+        self.assertTrue(snapshot.startswith(b'event: snapshot\n'))
+        await sync_to_async(publish_changes)({(self.user.id, self.question.id): (None, self.choice2.id)})
+        tally = await asyncio.wait_for(anext(stream), 2)
+        self.assertEqual(tally.split(b'\n')[0], b'event: tally')
+        self.assertEqual(json.loads(tally.split(b'data: ')[1])['deltas'], {str(self.choice2.id): 1})
+        await stream.aclose()
+
+    def test_results_stream_under_wsgi(self):
+        """
+        Under WSGI, which would wait for the endless stream to finish, the stream is refused.
+        """
+        response = self.client.get(reverse('polls:results_stream', args=(self.question.id,)))
+        self.assertEqual(response.status_code, 501)
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    async def test_stream_ends_when_client_leaves(self):
+        """
+        Served through ASGI, the stream of a client that disconnected ends and unsubscribes.
+        """
+        path = reverse('polls:results_stream', args=(self.question.id,))
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 1234), 'server': ('testserver', 80),
+        }
+        incoming = asyncio.Queue()
+        outgoing = asyncio.Queue()
+        await incoming.put({'type': 'http.request', 'body': b'', 'more_body': False})
+        # as the test client does, keep the test database connection open across the request
+        request_started.disconnect(close_old_connections)
+        try:
+            request = asyncio.ensure_future(CancelOnDisconnect(ASGIHandler())(scope, incoming.get, outgoing.put))
+            while (await asyncio.wait_for(outgoing.get(), 5))['type'] != 'http.response.body':
+                pass
+            self.assertEqual(get_broker().subscriber_count(), 1)
+            await incoming.put({'type': 'http.disconnect'})
+            await asyncio.wait_for(request, 5)
+        finally:
+            request_started.connect(close_old_connections)
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    async def test_stream_unsubscribes_on_close(self):
+        """
+        A closed stream stops receiving the changes of the question.
+        """
+        events = async_views._result_events(self.question.id, {})
+        await anext(events)
+        self.assertEqual(get_broker().subscriber_count(), 1)
+        await events.aclose()
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+
+CONCURRENT_VOTES_SCRIPT = """
+import json, threading
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from polls.models import Choice, Question, Vote
+from polls.voting import record_vote
+
+call_command('migrate', verbosity=0)
+question = Question.objects.create(question_text='Busy question')
+choice = Choice.objects.create(question=question, choice_text='Choice 1')
+User.objects.bulk_create([User(username=f'voter{i}') for i in range(20)])
+users = list(User.objects.all())
+barrier = threading.Barrier(len(users))
+errors = []
+
+def vote(user):
+    try:
+        barrier.wait()
+        record_vote(user, question, choice)
+    except Exception as error:
+        errors.append(repr(error))
+    finally:
+        connection.close()
+
+threads = [threading.Thread(target=vote, args=(user,)) for user in users]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+choice.refresh_from_db()
+print(json.dumps({'errors': errors, 'votes': Vote.objects.count(), 'counter': choice.vote_count}))
+"""
+
+
+class DatabaseProfileTests(TestCase):
+    """
+    Test case for the settings applied to database connections.
+    """
+
+    def test_concurrent_votes_on_sqlite_file(self):
+        """
+        Votes written at the same time to a SQLite file wait for the write lock instead of failing.
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, DATABASE_NAME=os.path.join(directory, 'db.sqlite3'), DATABASE_REPLICAS='')
+            output = subprocess.run(
+                [sys.executable, 'manage.py', 'shell', '-c', CONCURRENT_VOTES_SCRIPT],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120, check=True,
+            ).stdout
+        self.assertEqual(json.loads(output.splitlines()[-1]), {'errors': [], 'votes': 20, 'counter': 20})
+
+    def test_sqlite_pragmas(self):
+        """
+        New SQLite connections wait for the write lock and sync less often.
+        """
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            # 1 is NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+@override_settings(POLLS_READ_DATABASES=['replica0'])
+class ReplicaRoutingTests(TestCase):
+    """
+    Test case for sending reads to the replicas and writes to the primary.
+    """
+
+    def setUp(self):
+        """
+        Set up a user and a question with a choice.
+        """
+        self.router = PrimaryReplicaRouter()
+        with pin_primary():
+            self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+            self.question = Question.objects.create(question_text='Test Question')
+            self.choice = Choice.objects.create(question=self.question, choice_text='Choice 1')
+
+    def test_reads_go_to_replicas(self):
+        """
+        Reads go to a replica and writes to the primary.
+        """
+        self.assertEqual(self.router.db_for_read(Question), 'replica0')
+        self.assertEqual(self.router.db_for_write(Vote), 'default')
+
+    def test_pinned_reads_go_to_primary(self):
+        """
+        Reads inside pin_primary go to the primary.
+        """
+        with pin_primary():
+            self.assertEqual(self.router.db_for_read(Question), 'default')
+        self.assertEqual(self.router.db_for_read(Question), 'replica0')
+
+    def test_vote_pins_the_browser_to_primary(self):
+        """
+        Voting sets the cookie that pins the next requests to the primary.
+        """
+        with pin_primary():
+            self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertIn(PIN_COOKIE, self.client.cookies)
+        with mock.patch('polls.routers.random.choice', side_effect=AssertionError('read from a replica')):
+            response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertContains(response, 'Choice 1')
+
+    def close_question(self):
+        with pin_primary():
+            Question.objects.filter(pk=self.question.pk).update(
+                state=Question.CLOSED, end_date=timezone.now() - datetime.timedelta(hours=1),
+            )
+            return Question.objects.get(pk=self.question.pk)
+
+    def test_results_frozen_on_primary(self):
+        """
+        Results missing their snapshot are frozen and read back on the primary, not on a lagging replica.
+        """
+        question = self.close_question()
+        # the first read, which finds no snapshot, may go to a replica
+        with mock.patch('polls.routers.random.choice', side_effect=['default', AssertionError('read from a replica')]):
+            results = build_results(question)
+        self.assertEqual([choice['choice_text'] for choice in results['choices']], ['Choice 1'])
+
+    async def test_async_results_frozen_on_primary(self):
+        """
+        The async results are frozen and read back on the primary too.
+        """
+        question = await sync_to_async(self.close_question)()
+        with mock.patch('polls.routers.random.choice', side_effect=['default', AssertionError('read from a replica')]):
+            results = await abuild_results(question)
+        self.assertEqual([choice['choice_text'] for choice in results['choices']], ['Choice 1'])
+
+    def test_results_rebuilt_on_primary(self):
+        """
+        Results missing from the cache are rebuilt from the primary, which has the vote that moved their version.
+        """
+        cache.clear()
+        voteindex.clear()
+        with mock.patch('polls.routers.random.choice', side_effect=AssertionError('read from a replica')):
+            self.assertEqual(get_results(self.question.id)['choices'][0]['choice_text'], 'Choice 1')
+            self.assertIsNone(voteindex.get_choice(self.user.id, self.question.id))
+
+    async def test_async_results_rebuilt_on_primary(self):
+        """
+        The async results are rebuilt from the primary too.
+        """
+        await sync_to_async(cache.clear)()
+        with mock.patch('polls.routers.random.choice', side_effect=AssertionError('read from a replica')):
+            results = await aget_results(self.question.id)
+        self.assertEqual(results['choices'][0]['choice_text'], 'Choice 1')
+
+    @override_settings(POLLS_READ_DATABASES=[])
+    def test_no_cookie_without_replicas(self):
+        """
+        Without replicas, writes do not set the pinning cookie.
+        """
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class VoteTimelineTests(TestCase):
+    """
+    Test case for the vote timeline rollups and endpoint.
+    """
+
+    def setUp(self):
+        """
+        Set up two users and a question with two choices.
+        """
+        self.user1 = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.user2 = User.objects.create_user(username='Luke', password='@Iamyourson')
+        self.question = Question.objects.create(question_text='Test Question')
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+
+    def rollups(self, granularity):
+        return dict(VoteRollup.objects.filter(granularity=granularity).values_list('choice_id', 'votes'))
+
+    def test_votes_update_rollups(self):
+        """
+        Each vote adds to the minute, hour and day buckets; a switch moves the count.
+        """
+        record_vote(self.user1, self.question, self.choice1)
+        record_vote(self.user2, self.question, self.choice1)
+        record_vote(self.user2, self.question, self.choice2)
+        for granularity in ('minute', 'hour', 'day'):
+            self.assertEqual(self.rollups(granularity), {self.choice1.id: 1, self.choice2.id: 1})
+        vote = Vote.objects.get(user=self.user1)
+        self.assertEqual(VoteRollup.objects.get(choice=self.choice1, granularity='hour').bucket,
+                         bucket_start(vote.created_at, 'hour'))
+
+    def test_backfill(self):
+        """
+        The backfill command rebuilds the rollups from the Vote table.
+        """
+        two_days_ago = timezone.now() - datetime.timedelta(days=2)
+        Vote.objects.create(user=self.user1, choice=self.choice1, created_at=two_days_ago)
+        Vote.objects.create(user=self.user2, choice=self.choice2)
+        call_command('backfill_vote_rollups', stdout=StringIO())
+        self.assertEqual(VoteRollup.objects.filter(granularity='day').count(), 2)
+        self.assertEqual(VoteRollup.objects.get(choice=self.choice1, granularity='minute').bucket,
+                         bucket_start(two_days_ago, 'minute'))
+
+    def test_timeline_json(self):
+        """
+        The endpoint returns the per-bucket changes from the rollups.
+        """
+        record_vote(self.user1, self.question, self.choice1)
+        record_vote(self.user2, self.question, self.choice2)
+        response = self.client.get(reverse('polls:timeline', args=(self.question.id,)), {'granularity': 'minute'})
+        data = response.json()
+        self.assertEqual([choice['id'] for choice in data['choices']], [self.choice1.id, self.choice2.id])
+        self.assertEqual(len(data['buckets']), 1)
+        self.assertEqual(data['buckets'][0]['votes'], {str(self.choice1.id): 1, str(self.choice2.id): 1})
+
+    def test_timeline_bad_granularity(self):
+        """
+        An unknown granularity returns 404.
+        """
+        response = self.client.get(reverse('polls:timeline', args=(self.question.id,)), {'granularity': 'week'})
+        self.assertEqual(response.status_code, 404)
+
+
+class QuestionStateTests(TestCase):
+    """
+    Test case for the scheduled/open/closed state engine.
+    """
+
+    def setUp(self):
+        """
+        Start every test with an empty cache.
+        """
+        cache.clear()
+
+    def test_save_sets_state(self):
+        """
+        Saving a question sets its state from its dates.
+        """
+        now = timezone.now()
+        self.assertEqual(create_question(question_text="Future.", days=1).state, Question.SCHEDULED)
+        self.assertEqual(create_question(question_text="Past.", days=-1).state, Question.OPEN)
+        closed = Question.objects.create(question_text="Closed.", pub_date=now - datetime.timedelta(days=2),
+                                         end_date=now - datetime.timedelta(days=1))
+        self.assertEqual(closed.state, Question.CLOSED)
+
+    def test_advance_closes_and_freezes_results(self):
+        """
+        A question past its end date is closed and its final tally frozen.
+        """
+        question = create_question(question_text="Closing.", days=-2)
+        question.end_date = timezone.now() + datetime.timedelta(hours=1)
+        question.save()
+        choice = Choice.objects.create(question=question, choice_text='Choice 1')
+        record_vote(User.objects.create_user(username='Vader', password='@Iamyourfater'), question, choice)
+        moved = advance_states(timezone.now() + datetime.timedelta(hours=2))
+        self.assertEqual(moved[Question.CLOSED], [question.id])
+        question.refresh_from_db()
+        self.assertEqual(question.state, Question.CLOSED)
+        snapshot = QuestionResultSnapshot.objects.get(question=question)
+        self.assertEqual((snapshot.total, snapshot.choices),
+                         (1, [{'id': choice.id, 'choice_text': 'Choice 1', 'votes': 1}]))
+
+    def test_reopening_drops_snapshot(self):
+        """
+        Moving the end date of a closed question back into the future reopens it.
+        """
+        question = create_question(question_text="Closed.", days=-2)
+        question.end_date = timezone.now() - datetime.timedelta(days=1)
+        question.save()
+        self.assertTrue(QuestionResultSnapshot.objects.filter(question=question).exists())
+        question.end_date = None
+        question.save()
+        self.assertEqual(question.state, Question.OPEN)
+        self.assertFalse(QuestionResultSnapshot.objects.filter(question=question).exists())
+
+    def test_ensure_current_after_boundary(self):
+        """
+        Views open a scheduled question once its pub date has passed.
+        """
+        question = create_question(question_text="Future.", days=1)
+        ensure_current(timezone.now())
+        question.refresh_from_db()
+        self.assertEqual(question.state, Question.SCHEDULED)
+        ensure_current(timezone.now() + datetime.timedelta(days=2))
+        question.refresh_from_db()
+        self.assertEqual(question.state, Question.OPEN)
+
+    def test_vote_rejected_after_end_date_with_stale_boundary(self):
+        """
+        A vote after the end date is rejected even when this process's cached boundary missed the edit.
+        """
+        user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        question = create_question(question_text="Edited elsewhere.", days=-2)
+        choice = Choice.objects.create(question=question, choice_text='Choice 1')
+        next_boundary()
+        # another process moved the end date into the past; its invalidation did not reach this cache
+        Question.objects.filter(pk=question.pk).update(end_date=timezone.now() - datetime.timedelta(minutes=1))
+        self.client.force_login(user)
+        response = self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertRedirects(response, reverse('polls:index'))
+        response = self.client.post(reverse('polls:vote_batch'), json.dumps({'votes': {question.id: choice.id}}),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['votes'][str(question.id)]['status'], 'closed')
+        self.assertFalse(Vote.objects.exists())
+
+    def test_scheduler_command(self):
+        """
+        The scheduler reports the questions it moved.
+        """
+        question = create_question(question_text="Opening.", days=-1)
+        Question.objects.filter(pk=question.pk).update(state=Question.SCHEDULED)
+        out = StringIO()
+        call_command('run_poll_scheduler', once=True, stdout=out)
+        self.assertEqual(out.getvalue().strip(), f"open: {question.id}")
+
+
+class ClosedResultsTests(TestCase):
+    """
+    Test case for serving closed polls from their frozen snapshot and archiving their votes.
+    """
+
+    def setUp(self):
+        """
+        Set up a question with a vote that has since closed.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.question = create_question(question_text="Closed question.", days=-2)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        record_vote(self.user, self.question, self.choice)
+        self.question.end_date = timezone.now() - datetime.timedelta(hours=1)
+        self.question.save()
+
+    def test_results_served_from_snapshot(self):
+        """
+        The results of a closed question come from its snapshot, not the counters.
+        """
+        Choice.objects.filter(pk=self.choice.pk).update(vote_count=99)
+        response = self.client.get(reverse('polls:results_json', args=(self.question.id,)))
+        data = response.json()
+        self.assertEqual(data['total'], 1)
+        self.assertIsNotNone(data['frozen_at'])
+
+    def test_missing_snapshot_is_frozen_on_read(self):
+        """
+        A closed question without a snapshot gets one when its results are read.
+        """
+        QuestionResultSnapshot.objects.all().delete()
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+        self.assertTrue(QuestionResultSnapshot.objects.filter(question=self.question).exists())
+
+    def test_archive_votes(self):
+        """
+        Archiving writes the votes to a gzip file and prunes them, keeping the results and counters.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            out = StringIO()
+            call_command('archive_votes', output_dir=directory, stdout=out)
+            path = os.path.join(directory, f'question-{self.question.id}-votes.ndjson.gz')
+            with gzip.open(path, 'rt') as archive:
+                rows = [json.loads(line) for line in archive]
+        self.assertEqual([(row['user_id'], row['choice_id']) for row in rows], [(self.user.id, self.choice.id)])
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.question.refresh_from_db()
+        self.assertIsNotNone(self.question.votes_archived_at)
+        self.assertEqual(rebuild_vote_counts(), [])
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+
+
+class ConditionalPageTests(TestCase):
+    """
+    Test case for the validators of the question pages and their 304 responses.
+    """
+
+    def setUp(self):
+        """
+        Set up a logged in user and a published question with a choice.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.client.force_login(self.user)
+        self.question = create_question(question_text="Conditional question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Choice 1')
+
+    def test_detail_not_modified(self):
+        """
+        Revalidating an unchanged detail page with its ETag gets a 304.
+        """
+        url = reverse('polls:detail', args=(self.question.id,))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_vote_changes_results_etag(self):
+        """
+        A vote changes the ETag of the results page, so the full page is sent again.
+        """
+        url = reverse('polls:results', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('polls:vote', args=(self.question.id,)), {'choice': self.choice.id})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertContains(response, 'has been recorded successfully')
+
+    def test_etag_is_per_user(self):
+        """
+        The ETag of a page differs between users, whose pages differ.
+        """
+        url = reverse('polls:detail', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(User.objects.create_user(username='Luke', password='@Iamyourson'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_csrf_token_changes_detail_etag(self):
+        """
+        A new CSRF token (logging in again rotates it) changes the detail ETag, so the form is sent again.
+        """
+        url = reverse('polls:detail', args=(self.question.id,))
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = get_random_string(32)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_choice_change_updates_question(self):
+        """
+        Editing a choice marks its question as modified.
+        """
+        before = Question.objects.get(pk=self.question.pk).updated_at
+        self.choice.choice_text = 'Renamed'
+        self.choice.save()
+        self.assertGreater(Question.objects.get(pk=self.question.pk).updated_at, before)
+
+
+class PollAdminTests(TestCase):
+    """
+    Test case for the question changelist and its set-based bulk actions.
+    """
+
+    def setUp(self):
+        """
+        Set up a logged in superuser and an open question with a vote.
+        """
+        cache.clear()
+        self.admin = User.objects.create_superuser(username='Palpatine', password='@Iamthesenate')
+        self.client.force_login(self.admin)
+        self.question = create_question(question_text="Admin question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        record_vote(self.admin, self.question, self.choice)
+        self.url = reverse('admin:polls_question_changelist')
+
+    def act(self, action):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(self.url, {'action': action, '_selected_action': [self.question.id]})
+
+    def test_changelist_shows_totals(self):
+        """
+        The changelist shows each question's vote total from the counters.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_list[0].total, 1)
+
+    def test_close_now_and_reopen(self):
+        """
+        Closing freezes the results; reopening opens the question again without an end date.
+        """
+        self.act('close_now')
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.state, Question.CLOSED)
+        self.assertTrue(QuestionResultSnapshot.objects.filter(question=self.question).exists())
+        self.act('reopen')
+        self.question.refresh_from_db()
+        self.assertEqual(self.question.state, Question.OPEN)
+        self.assertIsNone(self.question.end_date)
+        self.assertFalse(QuestionResultSnapshot.objects.filter(question=self.question).exists())
+
+    def test_duplicate(self):
+        """
+        Duplicating copies the question and its choices, without votes.
+        """
+        self.act('duplicate')
+        copy = Question.objects.exclude(pk=self.question.pk).get()
+        self.assertEqual(copy.question_text, self.question.question_text)
+        self.assertEqual(copy.state, Question.OPEN)
+        self.assertEqual(list(copy.choice_set.values_list('choice_text', 'vote_count')), [('Choice 1', 0)])
+
+    def test_reset_votes(self):
+        """
+        Resetting deletes the votes and zeroes the counters, rollups and cached results.
+        """
+        self.assertEqual(get_results(self.question.id)['total'], 1)
+        self.act('reset_votes')
+        self.assertFalse(Vote.objects.filter(question=self.question).exists())
+        self.assertFalse(VoteRollup.objects.filter(question=self.question).exists())
+        self.assertEqual(Choice.objects.get(pk=self.choice.pk).vote_count, 0)
+        self.assertEqual(get_results(self.question.id)['total'], 0)
+
+
+class SignupTests(TestCase):
+    """
+    Test case for signing up, which logs the new user in with a single password hash.
+    """
+
+    data = {'username': 'Leia', 'password1': '@Helpmeobiwan', 'password2': '@Helpmeobiwan'}
+
+    def test_signup_logs_in_without_rehashing(self):
+        """
+        Signing up logs the new user in without checking the password again.
+        """
+        with mock.patch('django.contrib.auth.base_user.check_password') as check_password:
+            response = self.client.post(reverse('signup'), self.data)
+        self.assertRedirects(response, reverse('polls:index'))
+        check_password.assert_not_called()
+        self.assertEqual(int(self.client.session['_auth_user_id']), User.objects.get(username='Leia').id)
+
+    @override_settings(PASSWORD_HASHERS=['mysite.hashers.ScryptPasswordHasher', 'mysite.hashers.PBKDF2PasswordHasher'],
+                       PASSWORD_SCRYPT_WORK_FACTOR=2 ** 10)
+    def test_password_upgraded_at_login(self):
+        """
+        A password stored with an older hasher is rehashed with the current one at login.
+        """
+        user = User.objects.create(username='Han', password=make_password('@Ishotfirst', hasher='pbkdf2_sha256'))
+        self.assertTrue(self.client.login(username='Han', password='@Ishotfirst'))
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('scrypt$'))
+
+    async def test_async_signup(self):
+        """
+        The async signup stores the hashed password and logs the new user in.
+        """
+        request = AsyncRequestFactory().post(reverse('signup'), self.data)
+        request.session = SessionStore()
+        response = await asignup(request)
+        self.assertEqual(response.status_code, 302)
+        user = await User.objects.aget(username='Leia')
+        self.assertTrue(await sync_to_async(user.check_password)('@Helpmeobiwan'))
+        self.assertEqual(int(request.session['_auth_user_id']), user.id)
+
+
+class SessionAuthTests(TestCase):
+    """
+    Test case for the cached sessions and users, and the message storage.
+    """
+
+    def setUp(self):
+        """
+        Set up a logged in user and a published question.
+        """
+        cache.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.client.force_login(self.user)
+        self.question = create_question(question_text="Session question.", days=-1)
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    def test_repeat_request_skips_session_and_user_queries(self):
+        """
+        A logged in user's next request reads neither the session nor the user from the database.
+        """
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('auth_user', tables)
+
+    def test_password_change_logs_out_cached_user(self):
+        """
+        Changing the password ends the other sessions, even with the user cached.
+        """
+        self.client.get(self.url)
+        self.user.set_password('@Nooooooooo')
+        self.user.save()
+        self.assertRedirects(self.client.get(self.url), reverse('login'), fetch_redirect_response=False)
+
+    def test_message_storage_skips_empty_writes(self):
+        """
+        Reading the messages of a request that had none and added none writes nothing back.
+        """
+        storage = QuietCookieStorage(RequestFactory().get(self.url))
+        self.assertEqual(list(storage), [])
+        response = HttpResponse()
+        storage.update(response)
+        self.assertNotIn('messages', response.cookies)
+
+    def test_message_storage_clears_read_messages(self):
+        """
+        Messages that were read are still cleared from the storage.
+        """
+        request = RequestFactory().get(self.url)
+        request.COOKIES['messages'] = CookieStorage(request)._encode([Message(constants.INFO, 'Hello')])
+        storage = QuietCookieStorage(request)
+        self.assertEqual([str(message) for message in storage], ['Hello'])
+        response = HttpResponse()
+        storage.update(response)
+        self.assertEqual(response.cookies['messages'].value, '')
+
+
+class ShardedCounterTests(TestCase):
+    """
+    Test case for the sharded vote counters of hot questions and their compaction.
+    """
+
+    def setUp(self):
+        """
+        Set up a question with its counters spread over four shards, and some voters.
+        """
+        cache.clear()
+        self.question = create_question(question_text="Hot question.", days=-1)
+        self.question.counter_shards = 4
+        self.question.save()
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+        self.users = [User.objects.create_user(username=f'Trooper{i}', password='@Iamatrooper') for i in range(6)]
+        for user in self.users:
+            record_vote(user, self.question, self.choice1)
+        # a switched vote takes one from a shard of choice 1
+        record_vote(self.users[0], self.question, self.choice2)
+
+    def test_votes_go_to_shards(self):
+        """
+        The votes of a sharded question move its shards, not ``Choice.vote_count``.
+        """
+        self.assertEqual(Choice.objects.get(pk=self.choice1.pk).vote_count, 0)
+        self.assertTrue(ChoiceCounterShard.objects.filter(choice=self.choice1).exists())
+        self.assertLessEqual(ChoiceCounterShard.objects.filter(choice=self.choice1).count(), 4)
+
+    def test_results_sum_shards(self):
+        """
+        The results, the consistency check and the admin count the shards.
+        """
+        votes = {choice['id']: choice['votes'] for choice in get_results(self.question.id)['choices']}
+        self.assertEqual(votes, {self.choice1.id: 5, self.choice2.id: 1})
+        self.assertEqual(rebuild_vote_counts(check_only=True), [])
+        self.assertEqual(Question.objects.annotate(total=question_votes()).get(pk=self.question.pk).total, 6)
+        self.assertEqual((self.choice1.votes, self.choice2.votes), (5, 1))
+
+    def test_compact(self):
+        """
+        Compacting folds the shards into ``Choice.vote_count`` and keeps the totals.
+        """
+        call_command('compact_vote_counters', stdout=StringIO())
+        self.assertEqual(Choice.objects.get(pk=self.choice1.pk).vote_count, 5)
+        self.assertEqual(Choice.objects.get(pk=self.choice2.pk).vote_count, 1)
+        self.assertFalse(ChoiceCounterShard.objects.exclude(votes=0).exists())
+        self.assertEqual(rebuild_vote_counts(check_only=True), [])
+
+    def test_compact_drops_shards_of_unsharded_question(self):
+        """
+        A question set back to a single counter loses its shard rows at the next compaction.
+        """
+        self.question.counter_shards = 1
+        self.question.save()
+        compact_counters()
+        self.assertFalse(ChoiceCounterShard.objects.exists())
+        record_vote(self.users[1], self.question, self.choice2)
+        self.assertEqual(Choice.objects.get(pk=self.choice2.pk).vote_count, 2)
+
+
+class VoteIndexTests(TestCase):
+    """
+    Test case for the in-memory index of the users' choices and the my-votes endpoint.
+    """
+
+    def setUp(self):
+        """
+        Set up two questions, each with two choices, and a vote by another user.
+        """
+        cache.clear()
+        voteindex.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.other = User.objects.create_user(username='Luke', password='@Iamyourson')
+        self.question = create_question(question_text="Index question.", days=-1)
+        self.choice1 = Choice.objects.create(question=self.question, choice_text='Choice 1')
+        self.choice2 = Choice.objects.create(question=self.question, choice_text='Choice 2')
+        self.question2 = create_question(question_text="Other question.", days=-1)
+        self.choice3 = Choice.objects.create(question=self.question2, choice_text='Choice 3')
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(self.other, self.question, self.choice2)
+
+    def vote(self, user, question, choice):
+        with self.captureOnCommitCallbacks(execute=True):
+            record_vote(user, question, choice)
+
+    def test_lookup_without_query(self):
+        """
+        Once the map of a question is loaded, votes recorded since are answered from memory.
+        """
+        self.assertIsNone(voteindex.get_choice(self.user.id, self.question.id))
+        self.vote(self.user, self.question, self.choice1)
+        with self.assertNumQueries(0):
+            self.assertEqual(voteindex.get_choice(self.user.id, self.question.id), self.choice1.id)
+            self.assertEqual(voteindex.get_choice(self.other.id, self.question.id), self.choice2.id)
+
+    def test_detail_selects_vote_from_index(self):
+        """
+        The detail page selects the user's choice without reading the Vote table.
+        """
+        voteindex.get_choice(self.user.id, self.question.id)
+        self.client.force_login(self.other)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertEqual(response.context['user_vote'].choice_id, self.choice2.id)
+        self.assertFalse(any('polls_vote' in query['sql'] for query in queries.captured_queries))
+
+    def test_change_from_another_process(self):
+        """
+        A map whose question was changed elsewhere is not trusted: the vote is read from the database.
+        """
+        voteindex.get_choice(self.user.id, self.question.id)
+        # a vote recorded by another process moves the version without updating this map
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        bump_version(self.question.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(voteindex.get_choice(self.user.id, self.question.id), self.choice1.id)
+
+    def test_map_reloaded_past_max_age(self):
+        """
+        A map older than the maximum age is reloaded, even if no change was seen (an unshared cache).
+        """
+        voteindex.get_choice(self.user.id, self.question.id)
+        # another process's vote, with a version this process never sees
+        Vote.objects.create(user=self.user, question=self.question, choice=self.choice1)
+        later = mock.patch('polls.voteindex.time.monotonic', return_value=time.monotonic() + 30)
+        self.assertIsNone(voteindex.get_choice(self.user.id, self.question.id))
+        with later:
+            self.assertEqual(voteindex.get_choice(self.user.id, self.question.id), self.choice1.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(voteindex.get_choice(self.user.id, self.question.id), self.choice1.id)
+
+    @override_settings(POLLS_VOTE_INDEX_MAX_ENTRIES=1)
+    def test_question_over_cap_read_one_vote_at_a_time(self):
+        """
+        A question with more votes than the cap is not loaded again on every lookup; the user's vote is read alone.
+        """
+        self.vote(self.user, self.question, self.choice1)
+        self.assertEqual(voteindex.get_choice(self.user.id, self.question.id), self.choice1.id)
+        for user, choice in ((self.user, self.choice1), (self.other, self.choice2)):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(voteindex.get_choice(user.id, self.question.id), choice.id)
+            self.assertEqual(len(queries), 1)
+            self.assertIn('"polls_vote"."user_id" = ', queries[0]['sql'])
+
+    @override_settings(POLLS_VOTE_INDEX_MAX_ENTRIES=1)
+    def test_least_recently_used_map_evicted(self):
+        """
+        Past the cap, the least recently used map is dropped.
+        """
+        self.vote(self.user, self.question2, self.choice3)
+        voteindex.get_choice(self.other.id, self.question.id)
+        voteindex.get_choice(self.user.id, self.question2.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(voteindex.get_choice(self.other.id, self.question.id), self.choice2.id)
+
+    def test_my_votes(self):
+        """
+        The my-votes endpoint answers many questions with at most one query for them.
+        """
+        self.vote(self.user, self.question2, self.choice3)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:my_votes'), {'question': [self.question.id, self.question2.id]})
+        self.assertEqual(response.json(), {'votes': {str(self.question2.id): self.choice3.id}})
+
+
+class BatchVoteTests(TestCase):
+    """
+    Test case for voting on many questions in one request.
+    """
+
+    def setUp(self):
+        """
+        Set up a logged in user, three open questions with two choices each, and a closed one.
+        """
+        cache.clear()
+        voteindex.clear()
+        self.user = User.objects.create_user(username='Vader', password='@Iamyourfater')
+        self.client.force_login(self.user)
+        self.questions = [create_question(question_text=f"Survey question {i}.", days=-1) for i in range(3)]
+        self.choices = [
+            [Choice.objects.create(question=question, choice_text=f'Choice {j}') for j in range(2)]
+            for question in self.questions
+        ]
+        self.closed = create_question(question_text="Closed question.", days=-2)
+        self.closed_choice = Choice.objects.create(question=self.closed, choice_text='Too late')
+        self.closed.end_date = timezone.now() - datetime.timedelta(hours=1)
+        self.closed.save()
+
+    def post(self, votes):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('polls:vote_batch'), json.dumps({'votes': votes}),
+                                    content_type='application/json')
+
+    def test_batch_vote(self):
+        """
+        Every valid selection is recorded and reported, in one request.
+        """
+        response = self.post({
+            str(question.id): choices[1].id for question, choices in zip(self.questions, self.choices)
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({outcome['status'] for outcome in response.json()['votes'].values()}, {'recorded'})
+        self.assertEqual(
+            set(Vote.objects.filter(user=self.user).values_list('choice_id', flat=True)),
+            {choices[1].id for choices in self.choices},
+        )
+        self.assertEqual(get_results(self.questions[0].id)['total'], 1)
+        self.assertEqual(voteindex.get_choice(self.user.id, self.questions[2].id), self.choices[2][1].id)
+
+    def test_outcomes(self):
+        """
+        Unchanged, closed, unknown and mismatched selections are reported without being recorded.
+        """
+        record_vote(self.user, self.questions[0], self.choices[0][0])
+        response = self.post({
+            str(self.questions[0].id): self.choices[0][0].id,
+            str(self.questions[1].id): self.choices[2][0].id,
+            str(self.closed.id): self.closed_choice.id,
+            '9999': self.choices[0][0].id,
+        })
+        statuses = {question_id: outcome['status'] for question_id, outcome in response.json()['votes'].items()}
+        self.assertEqual(statuses, {
+            str(self.questions[0].id): 'unchanged',
+            str(self.questions[1].id): 'invalid_choice',
+            str(self.closed.id): 'closed',
+            '9999': 'not_found',
+        })
+        self.assertEqual(Vote.objects.filter(user=self.user).count(), 1)
+
+    def test_bad_body(self):
+        """
+        A body that is not a map of question ids to choice ids is rejected.
+        """
+        response = self.client.post(reverse('polls:vote_batch'), '{"votes": ["x"]}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
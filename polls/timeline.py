@@ -0,0 +1,158 @@
+"""
+Module for the per-minute, per-hour and per-day vote timeline of a question.
+
+Every recorded vote adds its counter changes to a VoteRollup row for the
+minute, the hour and the day it was cast in (in the current time zone), in
+the same transaction as the vote.  A timeline is then read from the rollups
+alone: a few hundred rows however many votes the question has.
+
+Rollups hold net changes, so switching a vote takes one from the old choice
+and adds one to the new choice in the bucket of the switch.  The running
+vote count of a choice is the cumulative sum of its buckets.
+"""
+import datetime
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Trunc
+from django.http import Http404
+from django.utils import timezone
+
+from .models import Question, Vote, VoteRollup
+from .routers import pin_primary
+
+STEPS = {
+    'minute': datetime.timedelta(minutes=1),
+    'hour': datetime.timedelta(hours=1),
+    'day': datetime.timedelta(days=1),
+}
+
+
+def bucket_start(when, granularity):
+    """Return the start of the ``granularity`` bucket ``when`` falls in, in the current time zone."""
+    local = timezone.localtime(when)
+    if granularity == 'minute':
+        return local.replace(second=0, microsecond=0)
+    if granularity == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    return local.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_to_rollups(deltas, when):
+    """
+    Add vote counter changes made at ``when`` to the rollups, with two queries.
+
+    The missing bucket rows are inserted first (existing ones are left
+    alone), then every row is moved by its change in one UPDATE.
+
+    Args:
+        deltas (dict): Maps (question_id, choice_id) to the change of the choice's vote count.
+        when (datetime): When the votes were recorded.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    buckets = {granularity: bucket_start(when, granularity) for granularity in STEPS}
+    VoteRollup.objects.bulk_create(
+        [
+            VoteRollup(question_id=question_id, choice_id=choice_id, granularity=granularity, bucket=bucket)
+            for (question_id, choice_id) in sorted(deltas)
+            for granularity, bucket in buckets.items()
+        ],
+        ignore_conflicts=True,
+    )
+    VoteRollup.objects.filter(
+        reduce(or_, (Q(granularity=granularity, bucket=bucket) for granularity, bucket in buckets.items())),
+        choice_id__in=[choice_id for _, choice_id in deltas],
+    ).update(votes=F('votes') + Case(
+        *(When(choice_id=choice_id, then=Value(delta)) for (_, choice_id), delta in deltas.items()),
+        default=Value(0),
+    ))
+
+
+def backfill_rollups(question_ids=None, batch_size=5000):
+    """
+    Rebuild the rollups from the Vote table.
+
+    Each vote counts once in the buckets of its ``created_at``; the history of
+    switched votes is not kept in the Vote table, so it is lost.
+
+    Args:
+        question_ids (iterable): Only rebuild these questions (default: all).
+        batch_size (int): Rollup rows written per ``bulk_create``.
+
+    Returns:
+        int: The number of rollup rows written.
+    """
+    # the votes of archived questions are gone, their rollups are kept
+    votes = Vote.objects.filter(question__votes_archived_at__isnull=True)
+    rollups = VoteRollup.objects.filter(question__votes_archived_at__isnull=True)
+    if question_ids is not None:
+        votes = votes.filter(question_id__in=question_ids)
+        rollups = rollups.filter(question_id__in=question_ids)
+    written = 0
+    with pin_primary(), transaction.atomic():
+        rollups.delete()
+        for granularity in STEPS:
+            rows = (
+                votes.annotate(bucket=Trunc('created_at', granularity))
+                .values('question_id', 'choice_id', 'bucket')
+                .annotate(n=Count('id'))
+                .order_by()
+            )
+            batch = []
+            for row in rows.iterator():
+                batch.append(VoteRollup(question_id=row['question_id'], choice_id=row['choice_id'],
+                                        granularity=granularity, bucket=row['bucket'], votes=row['n']))
+                if len(batch) >= batch_size:
+                    VoteRollup.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            VoteRollup.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+
+def get_timeline(question_id, granularity='hour', since=None, until=None, max_buckets=500):
+    """
+    Return the vote timeline of a question from its rollups.
+
+    Args:
+        question_id (int): The question.
+        granularity (str): 'minute', 'hour' or 'day'.
+        since (datetime): Start of the timeline (default: ``max_buckets`` buckets before ``until``).
+        until (datetime): End of the timeline (default: now).
+        max_buckets (int): The longest timeline returned, in buckets.
+
+    Returns:
+        dict: The question, its choices and, per bucket with votes, the net
+        change of each choice's vote count keyed by choice id.
+
+    Raises:
+        Http404: If the question does not exist.
+    """
+    try:
+        question = Question.objects.get(pk=question_id)
+    except Question.DoesNotExist:
+        raise Http404("Question does not exist")
+    until = until or timezone.now()
+    earliest = until - STEPS[granularity] * max_buckets
+    since = bucket_start(max(since, earliest) if since else earliest, granularity)
+    rows = VoteRollup.objects.filter(
+        question_id=question_id, granularity=granularity, bucket__gte=since, bucket__lte=until,
+    ).exclude(votes=0).order_by('bucket', 'choice_id').values_list('bucket', 'choice_id', 'votes')
+    buckets = []
+    for bucket, choice_id, votes in rows:
+        if not buckets or buckets[-1]['start'] != bucket:
+            buckets.append({'start': bucket, 'votes': {}})
+        buckets[-1]['votes'][str(choice_id)] = votes
+    return {
+        'question': {'id': question.id, 'question_text': question.question_text},
+        'granularity': granularity,
+        'since': since,
+        'until': until,
+        'choices': list(question.choice_set.order_by('id').values('id', 'choice_text')),
+        'buckets': buckets,
+    }
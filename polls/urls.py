@@ -1,11 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
+
+if settings.POLLS_ASYNC_VIEWS:
+    detail_view = async_views.DetailView.as_view()
+    vote_view = async_views.vote
+    results_view = async_views.ResultsView.as_view()
+else:
+    detail_view = views.DetailView.as_view()
+    vote_view = views.vote
+    results_view = views.ResultsView.as_view()
 
 app_name = 'polls'
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:question_id>/vote/', views.vote, name='vote'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
+    path('index.json', views.index_json, name='index_json'),
+    path('<int:pk>/', detail_view, name='detail'),
+    path('<int:question_id>/vote/', vote_view, name='vote'),
+    path('vote.json', views.vote_batch, name='vote_batch'),
+    path('<int:pk>/results/', results_view, name='results'),
+    path('<int:pk>/results.json', views.results_json, name='results_json'),
+    path('<int:pk>/results/stream', async_views.results_stream, name='results_stream'),
+    path('<int:pk>/timeline.json', views.timeline_json, name='timeline'),
+    path('my-votes.json', views.my_votes, name='my_votes'),
+    path('export/<str:kind>.<str:fmt>', views.export, name='export'),
+    path('metrics.json', views.metrics, name='metrics'),
+    path('results/cache-stats.json', views.results_cache_stats, name='results_cache_stats'),
 ]
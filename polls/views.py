@@ -4,14 +4,30 @@ Module for defining views related to polls.
 This module contains Django views for handling poll-related functionality,
 including voting, displaying poll details, and showing poll results.
 """
-from django.http import Http404, HttpResponseRedirect
+import json
+
+from django.conf import settings
+from django.http import Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from . import voteindex
 from .models import Choice, Question, Vote
+from .conditional import add_validators, csrf_secret, not_modified, page_etag
+from .export import CONTENT_TYPES, FORMATS, KINDS, export_lines
+from .ingest import get_vote_buffer, is_buffered
+from .listing import cached_listing, question_page
+from .metrics import registry
+from .results import cache_stats, get_results
+from .states import ensure_current
+from .timeline import STEPS, get_timeline
+from .voting import record_vote, record_votes
 from django.shortcuts import redirect, render
 from django.urls import reverse
 from django.views import generic
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
 
 
 @login_required
@@ -28,13 +44,17 @@ def vote(request, question_id):
     """
     if not request.user.is_authenticated:
         return redirect("login")
+    now = timezone.now()
+    ensure_current(now)
     try:
         question = Question.objects.get(pk=question_id)
     except Question.DoesNotExist:
         raise Http404("Question does not exist")
+    # from the clock too: the stored state lags when another process changed the dates
+    state = question.state_at(now)
 
     # Check if the question is published
-    if not question.is_published():
+    if state == Question.SCHEDULED:
         messages.error(request, "This question is not currently published.")
         return HttpResponseRedirect(reverse('polls:index'))
 
@@ -42,44 +62,146 @@ def vote(request, question_id):
         selected_choice = question.choice_set.get(pk=request.POST['choice'])
     except (KeyError, Choice.DoesNotExist):
         messages.error(request, "You didn't select a choice.")
-        return render(request, 'polls/detail.html', {'question': question})
+        return render(request, 'polls/detail.html', {'question': question, 'choices': question.choice_set.all()})
     else:
         # Check if the end date has passed
-        if question.end_date and timezone.now() > question.end_date:
+        if state == Question.CLOSED:
             messages.error(request, 'Voting for this question is not allowed as the end date has passed.')
             return HttpResponseRedirect(reverse('polls:index'))
 
-        # Check if voting is allowed for this question
-        if not question.can_vote():
-            messages.error(request, "Voting for this question is not allowed at the moment.")
-            return HttpResponseRedirect(reverse('polls:index'))
+    if is_buffered():
+        get_vote_buffer().submit(request.user.id, question.id, selected_choice.id)
+        messages.success(request, f"Your vote for '{question.question_text}' has been received.")
+        return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
-    this_user = request.user
-    try:
-        # find a vote for this user and this question
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        # update a choice
-        vote.choice = selected_choice
-        vote.save()
-    except Vote.DoesNotExist:
-        # No match vote = create a new Vote
-        vote = Vote(user=this_user, choice=selected_choice)
-        vote.save()
+    record_vote(request.user, question, selected_choice)
 
     # Display a success message
     messages.success(request, f"Your vote for '{question.question_text}' has been recorded successfully.")
     return HttpResponseRedirect(reverse('polls:results', args=(question.id,)))
 
 
+@login_required
+@require_POST
+def vote_batch(request):
+    """
+    Record the user's votes on many questions at once, e.g. the questions of a survey.
+
+    The body is JSON: ``{"votes": {"<question id>": <choice id>, ...}}``.  All
+    the questions are checked with one query and all the choices with
+    another, and the valid votes are recorded in one transaction.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+
+    Returns:
+        JsonResponse: The outcome of each question: 'recorded', 'unchanged',
+        'received' (buffered ingestion), 'not_found', 'closed' or 'invalid_choice'.
+    """
+    try:
+        selections = json.loads(request.body)['votes']
+        selections = {int(question_id): int(choice_id) for question_id, choice_id in selections.items()}
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return JsonResponse({'error': 'Expected {"votes": {"<question id>": <choice id>, ...}}.'}, status=400)
+    if len(selections) > settings.POLLS_BATCH_VOTE_MAX_QUESTIONS:
+        return JsonResponse({'error': f'At most {settings.POLLS_BATCH_VOTE_MAX_QUESTIONS} questions per request.'},
+                            status=400)
+    now = timezone.now()
+    ensure_current(now)
+    questions = Question.objects.in_bulk(selections)
+    choices = Choice.objects.only('id', 'question_id').in_bulk(selections.values())
+    outcomes = {}
+    votes = {}
+    for question_id, choice_id in selections.items():
+        question = questions.get(question_id)
+        choice = choices.get(choice_id)
+        if question is None or question.state_at(now) == Question.SCHEDULED:
+            outcomes[question_id] = 'not_found'
+        elif question.state_at(now) == Question.CLOSED:
+            outcomes[question_id] = 'closed'
+        elif choice is None or choice.question_id != question_id:
+            outcomes[question_id] = 'invalid_choice'
+        else:
+            votes[request.user.id, question_id] = choice_id
+
+    if is_buffered():
+        buffer = get_vote_buffer()
+        for (user_id, question_id), choice_id in votes.items():
+            buffer.submit(user_id, question_id, choice_id)
+            outcomes[question_id] = 'received'
+    else:
+        changes = record_votes(votes, shards={question_id: questions[question_id].counter_shards
+                                              for _, question_id in votes})
+        for key in votes:
+            outcomes[key[1]] = 'recorded' if key in changes else 'unchanged'
+
+    return JsonResponse({'votes': {
+        str(question_id): {'status': outcomes[question_id], 'choice': selections[question_id]}
+        for question_id in selections
+    }})
+
+
 class IndexView(generic.ListView):
-    """View for displaying the list of latest published questions."""
+    """View for displaying the list of latest published questions, one page at a time."""
 
     template_name = 'polls/index.html'
     context_object_name = 'latest_question_list'
 
+    def get_page(self):
+        """Return the page of questions selected by the ``cursor`` and ``status`` parameters."""
+        return get_index_page(self.request)
+
     def get_queryset(self):
-        """Return the last five published questions (not including those set to republished in the future)."""
-        return Question.objects.filter(pub_date__lte=timezone.now()).order_by('-pub_date')[:5]
+        """Return the published questions on the requested page (not including those published in the future)."""
+        self.page = self.get_page()
+        return self.page['questions']
+
+    def get_context_data(self, **kwargs):
+        """Adds the cursor of the next page and the status filter to the context."""
+        context = super().get_context_data(**kwargs)
+        context['next_cursor'] = self.page['next_cursor']
+        # keys the cached fragment of the list
+        context['listing_key'] = self.page['cache_key']
+        context['status'] = self.request.GET.get('status', '')
+        return context
+
+
+def get_index_page(request):
+    """Return the cached page of published questions requested by ``request``."""
+    now = timezone.now()
+    ensure_current(now)
+    cursor = request.GET.get('cursor') or None
+    status = request.GET.get('status')
+    if status not in ('open', 'closed'):
+        status = None
+    return cached_listing(
+        f'{status}:{cursor}', lambda: question_page(cursor=cursor, status=status), now
+    )
+
+
+def index_json(request):
+    """
+    Return a page of the published questions as JSON.
+
+    Accepts the same ``cursor`` and ``status`` parameters as the index page.
+
+    Returns:
+        JsonResponse: The questions on the page and the cursor of the next page.
+    """
+    page = get_index_page(request)
+    return JsonResponse({
+        'questions': [
+            {
+                'id': question.id,
+                'question_text': question.question_text,
+                'pub_date': question.pub_date,
+                'end_date': question.end_date,
+                'is_open': question.is_open,
+            }
+            for question in page['questions']
+        ],
+        'next_cursor': page['next_cursor'],
+    })
 
 
 class DetailView(generic.DetailView):
@@ -90,33 +212,165 @@ class DetailView(generic.DetailView):
 
     def get_queryset(self):
         """Excludes any questions that aren't published yet."""
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.exclude(state=Question.SCHEDULED)
 
     def dispatch(self, request, *args, **kwargs):
         # Check if the user is authenticated, and if not, redirect to the login page.
         if not request.user.is_authenticated:
             return redirect("login")
+        ensure_current()
         return super().dispatch(request, *args, **kwargs)
 
+    def get(self, request, *args, **kwargs):
+        """Shows the question, or answers 304 when the client's copy is current."""
+        self.object = self.get_object()
+        last_modified = self.object.last_modified()
+        etag = page_etag(self.object.id, last_modified, request.user.id, csrf_secret(request))
+        response = not_modified(request, etag, last_modified)
+        if response is None:
+            response = self.render_to_response(self.get_context_data(object=self.object))
+        return add_validators(response, etag, last_modified)
+
     def get_context_data(self, **kwargs):
         """Retrieves and prepares context data for rendering a template."""
         context = super().get_context_data(**kwargs)
         user_vote = None
 
         if self.request.user.is_authenticated:
-            try:
-                # Get the user's previous vote for this question
-                user_vote = Vote.objects.get(user=self.request.user, choice__question=self.object)
-            except Vote.DoesNotExist:
-                pass
+            # Get the user's previous vote for this question, from the vote index
+            choice_id = voteindex.get_choice(self.request.user.id, self.object.id)
+            if choice_id is not None:
+                user_vote = Vote(user=self.request.user, question=self.object, choice_id=choice_id)
 
         context['error_message'] = None
         context['user_vote'] = user_vote
+        # only queried when the cached fragment of the choices is missing
+        context['choices'] = self.object.choice_set.all()
         return context
 
 
-class ResultsView(generic.DetailView):
+class ResultsView(generic.TemplateView):
     """View for displaying the results of a specific question."""
 
-    model = Question
     template_name = 'polls/results.html'
+
+    def get(self, request, *args, **kwargs):
+        """Shows the cached results, or answers 304 when the client's copy is current."""
+        results = get_results(self.kwargs['pk'])
+        etag = page_etag(results['question']['id'], results['last_modified'], request.user.id)
+        response = not_modified(request, etag, results['last_modified'])
+        if response is None:
+            response = self.render_to_response(self.get_context_data(results=results, **kwargs))
+        return add_validators(response, etag, results['last_modified'])
+
+    def get_context_data(self, **kwargs):
+        """Adds the question of the cached results to the context."""
+        context = super().get_context_data(**kwargs)
+        context['question'] = context['results']['question']
+        return context
+
+
+def results_json(request, pk):
+    """
+    Return the results of a specific question as JSON.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        pk (int): The ID of the question.
+
+    Returns:
+        JsonResponse: Every choice with its vote count and percentage, and the total.
+    """
+    results = get_results(pk)
+    etag = page_etag(pk, results['last_modified'])
+    response = not_modified(request, etag, results['last_modified']) or JsonResponse(results)
+    return add_validators(response, etag, results['last_modified'])
+
+
+def timeline_json(request, pk):
+    """
+    Return the vote timeline of a specific question as JSON.
+
+    Args:
+        request (HttpRequest): The HTTP request object, optionally with ``granularity``
+            ('minute', 'hour' or 'day'), ``since`` and ``until`` (ISO 8601) parameters.
+        pk (int): The ID of the question.
+
+    Returns:
+        JsonResponse: The net change of each choice's vote count per time bucket.
+    """
+    granularity = request.GET.get('granularity', 'hour')
+    if granularity not in STEPS:
+        raise Http404("Unknown granularity")
+    bounds = {}
+    for name in ('since', 'until'):
+        value = request.GET.get(name)
+        if value:
+            try:
+                bounds[name] = parse_datetime(value)
+            except ValueError:
+                bounds[name] = None
+            if bounds[name] is None:
+                raise Http404(f"Invalid {name}")
+            if timezone.is_naive(bounds[name]):
+                bounds[name] = timezone.make_aware(bounds[name])
+    return JsonResponse(get_timeline(pk, granularity, max_buckets=settings.POLLS_TIMELINE_MAX_BUCKETS, **bounds))
+
+
+@login_required
+def my_votes(request):
+    """
+    Return the choices the user voted for on many questions as JSON.
+
+    Args:
+        request (HttpRequest): The HTTP request object, with one ``question``
+            parameter per question id (at most ``POLLS_MY_VOTES_MAX_QUESTIONS``).
+
+    Returns:
+        JsonResponse: Maps the id of every listed question the user voted on to the chosen choice id.
+    """
+    question_ids = request.GET.getlist('question')
+    if not all(question_id.isdigit() for question_id in question_ids):
+        raise Http404("Unknown question")
+    if len(question_ids) > settings.POLLS_MY_VOTES_MAX_QUESTIONS:
+        raise Http404("Too many questions")
+    choices = voteindex.get_choices(request.user.id, sorted({int(question_id) for question_id in question_ids}))
+    return JsonResponse({'votes': {str(question_id): choice_id for question_id, choice_id in choices.items()}})
+
+
+@staff_member_required
+def results_cache_stats(request):
+    """Return the hit and miss counters of the results cache as JSON."""
+    return JsonResponse(cache_stats())
+
+
+@staff_member_required
+def metrics(request):
+    """Return the per-view query and latency histograms of this process as JSON."""
+    return JsonResponse({'views': registry.snapshot(), 'results_cache': cache_stats()})
+
+
+@staff_member_required
+def export(request, kind, fmt):
+    """
+    Stream votes or results as CSV or NDJSON.
+
+    Args:
+        request (HttpRequest): The HTTP request object, optionally with a ``question`` id parameter.
+        kind (str): 'votes' or 'results'.
+        fmt (str): 'csv' or 'ndjson'.
+
+    Returns:
+        StreamingHttpResponse: The export, written row by row.
+    """
+    if kind not in KINDS or fmt not in FORMATS:
+        raise Http404("Unknown export")
+    question_id = request.GET.get('question')
+    if question_id is not None and not question_id.isdigit():
+        raise Http404("Unknown question")
+    response = StreamingHttpResponse(
+        export_lines(kind, fmt, int(question_id) if question_id else None),
+        content_type=CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{fmt}"'
+    return response
@@ -0,0 +1,185 @@
+"""
+Module for answering "which choice did this user pick" from memory.
+
+Each process keeps, for the questions recently looked at, a map of user id
+to choice id, loaded with one query the first time the question is asked
+about.  The maps are kept in least recently used order and the coldest are
+dropped once they hold more than ``POLLS_VOTE_INDEX_MAX_ENTRIES`` votes in
+all.  A question with more votes than that is remembered without its map,
+and its users' votes are read one at a time from the database.
+
+A map is tagged with the results version of its question (see
+``polls.results``), which every committed vote and edit moves.  Votes
+recorded by this process are applied to the map and move its tag along, so
+in a single process the map always answers.  When the version has been
+moved by another process the map is reloaded, at most once every
+``POLLS_VOTE_INDEX_RELOAD_SECONDS``; until then the user's vote is read from
+the database.
+
+The versions are only seen by every process when the cache is shared.  With
+a per-process cache (``LocMemCache``) a vote in another process leaves this
+process's version alone, so a map is also dropped once it is older than
+``POLLS_VOTE_INDEX_MAX_AGE_SECONDS``, whatever its version.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .models import Vote
+from .results import aget_version, get_version, get_versions
+from .routers import pin_primary
+
+_lock = threading.Lock()
+# question id -> _Entry, least recently used first
+_entries = OrderedDict()
+_size = 0
+
+
+class _Entry:
+    """The map of a question; ``choices`` is None for a question with too many votes to keep."""
+
+    __slots__ = ('version', 'choices', 'loaded_at')
+
+    def __init__(self, version, choices):
+        self.version = version
+        self.choices = choices
+        self.loaded_at = time.monotonic()
+
+
+def _lookup(question_id, user_id, version):
+    """Return (True, choice id or None) when the map of the question is current, else (False, None)."""
+    with _lock:
+        entry = _entries.get(question_id)
+        if entry is None or entry.choices is None or entry.version != version:
+            return False, None
+        if time.monotonic() - entry.loaded_at >= settings.POLLS_VOTE_INDEX_MAX_AGE_SECONDS:
+            return False, None
+        _entries.move_to_end(question_id)
+        return True, entry.choices.get(user_id)
+
+
+def _should_reload(question_id):
+    with _lock:
+        entry = _entries.get(question_id)
+    if entry is None:
+        return True
+    age = time.monotonic() - entry.loaded_at
+    if entry.choices is None:
+        # check now and then whether the question has shrunk below the cap
+        return age >= settings.POLLS_VOTE_INDEX_MAX_AGE_SECONDS
+    return age >= min(settings.POLLS_VOTE_INDEX_RELOAD_SECONDS, settings.POLLS_VOTE_INDEX_MAX_AGE_SECONDS)
+
+
+def _weight(entry):
+    return 1 if entry.choices is None else len(entry.choices)
+
+
+def _evict():
+    """Drop the least recently used maps until the cap is met; call with the lock held."""
+    global _size
+    while _size > settings.POLLS_VOTE_INDEX_MAX_ENTRIES:
+        _, evicted = _entries.popitem(last=False)
+        _size -= _weight(evicted)
+
+
+def _store(question_id, entry):
+    global _size
+    with _lock:
+        old = _entries.pop(question_id, None)
+        if old is not None:
+            _size -= _weight(old)
+        _entries[question_id] = entry
+        _size += _weight(entry)
+        _evict()
+
+
+def _load(question_id, user_id, version):
+    if _should_reload(question_id):
+        cap = settings.POLLS_VOTE_INDEX_MAX_ENTRIES
+        # from the primary: a lagging replica's map would be tagged with a version it has not caught up with;
+        # one row past the cap tells a question with too many votes, without reading them all
+        with pin_primary():
+            rows = Vote.objects.filter(question_id=question_id).values_list('user_id', 'choice_id')[:cap + 1]
+            entry = _Entry(version, dict(rows))
+        if len(entry.choices) > cap:
+            # remembered without its map, so that its votes are not all read again on every lookup
+            entry.choices = None
+        _store(question_id, entry)
+        if entry.choices is not None:
+            return entry.choices.get(user_id)
+    return Vote.objects.filter(user_id=user_id, question_id=question_id).values_list('choice_id', flat=True).first()
+
+
+def get_choice(user_id, question_id):
+    """Return the id of the choice ``user_id`` voted for on ``question_id``, or None."""
+    version = get_version(question_id)
+    found, choice_id = _lookup(question_id, user_id, version)
+    if found:
+        return choice_id
+    return _load(question_id, user_id, version)
+
+
+async def aget_choice(user_id, question_id):
+    """Async version of ``get_choice``; only a reload leaves the event loop."""
+    version = await aget_version(question_id)
+    found, choice_id = _lookup(question_id, user_id, version)
+    if found:
+        return choice_id
+    return await sync_to_async(_load)(question_id, user_id, version)
+
+
+def get_choices(user_id, question_ids):
+    """
+    Return the choices ``user_id`` voted for on each of ``question_ids``.
+
+    Questions whose map is current are answered from memory, the rest with
+    a single query.
+
+    Returns:
+        dict: Maps each question id the user voted on to the chosen choice id.
+    """
+    choices = {}
+    missing = []
+    for question_id, version in get_versions(question_ids).items():
+        found, choice_id = _lookup(question_id, user_id, version)
+        if not found:
+            missing.append(question_id)
+        elif choice_id is not None:
+            choices[question_id] = choice_id
+    if missing:
+        votes = Vote.objects.filter(user_id=user_id, question_id__in=missing)
+        choices.update(votes.values_list('question_id', 'choice_id'))
+    return choices
+
+
+def record(question_id, selections, version):
+    """
+    Apply votes committed by this process to the map of their question.
+
+    Args:
+        question_id (int): The question voted on.
+        selections (dict): Maps user ids to the choice ids they now have selected.
+        version (int): The results version the votes moved the question to.
+    """
+    global _size
+    with _lock:
+        entry = _entries.get(question_id)
+        if entry is None or entry.choices is None:
+            return
+        _size += sum(1 for user_id in selections if user_id not in entry.choices)
+        entry.choices.update(selections)
+        # a gap means another process changed the question meanwhile: the map stays stale
+        if version == entry.version + 1:
+            entry.version = version
+        _evict()
+
+
+def clear():
+    """Drop every map."""
+    global _size
+    with _lock:
+        _entries.clear()
+        _size = 0
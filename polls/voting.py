@@ -0,0 +1,187 @@
+"""
+Module for recording votes and maintaining the per-choice vote counters.
+
+Every code path that creates or switches a Vote goes through this module so
+that the vote counters (``polls.counters``) and the timeline rollups
+stay in step with the rows in the Vote table, the cached results of the
+question are invalidated and live results subscribers are notified once the
+change is committed.
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import voteindex
+from .counters import apply_count_deltas, choice_votes
+from .events import publish_changes
+from .models import Choice, ChoiceCounterShard, Question, Vote
+from .results import bump_version
+from .routers import pin_primary
+from .timeline import add_to_rollups
+
+
+def record_vote(user, question, choice):
+    """
+    Record ``user``'s vote for ``choice`` on ``question``.
+
+    Creates a new Vote or switches the existing one, and updates the vote
+    counters in the same transaction.
+
+    Returns:
+        int: The choice the user had selected before, or None when the user
+        had not voted on this question before.
+    """
+    changes = record_votes({(user.id, question.id): choice.id}, shards={question.id: question.counter_shards})
+    old_choice_id, _ = changes.get((user.id, question.id), (choice.id, choice.id))
+    return old_choice_id
+
+
+def record_votes(votes, shards=None):
+    """
+    Record many votes at once with a single insert and a single upsert.
+
+    The previous selections are read first (through the (user, question)
+    index, under a row lock) so that the counters can be moved.  A first vote
+    has no row to lock, so the first votes are inserted on their own: when
+    the unique (user, question) constraint rejects them, a concurrent first
+    vote of the same user was committed meanwhile, and the selections are
+    read again to count from it.  The switched votes are then written in one
+    ``INSERT ... ON CONFLICT`` statement.
+
+    Args:
+        votes (dict): Maps (user_id, question_id) to the selected choice id.
+            Each key appears once, so the latest selection wins.
+        shards (dict): The ``counter_shards`` of the questions, when known;
+            see ``polls.counters.apply_count_deltas``.
+
+    Returns:
+        dict: Maps (user_id, question_id) to (old_choice_id, new_choice_id)
+        for every vote that was created or switched.
+    """
+    if not votes:
+        return {}
+    now = timezone.now()
+    with transaction.atomic():
+        _take_write_lock()
+        existing = _locked_selections(votes)
+        while True:
+            first = [key for key in votes if key not in existing]
+            if not first:
+                break
+            try:
+                with transaction.atomic():
+                    Vote.objects.bulk_create([
+                        Vote(user_id=user_id, question_id=question_id, choice_id=votes[user_id, question_id],
+                             created_at=now)
+                        for user_id, question_id in first
+                    ])
+                break
+            except IntegrityError:
+                raced = _locked_selections(first)
+                if not raced:
+                    raise
+                existing.update(raced)
+        changes = {}
+        for key, choice_id in votes.items():
+            old_choice_id = existing.get(key)
+            if old_choice_id != choice_id:
+                changes[key] = (old_choice_id, choice_id)
+        switched = [
+            Vote(user_id=user_id, question_id=question_id, choice_id=new_choice_id, created_at=now)
+            for (user_id, question_id), (old_choice_id, new_choice_id) in changes.items()
+            if old_choice_id is not None
+        ]
+        if switched:
+            Vote.objects.bulk_create(
+                switched, update_conflicts=True, unique_fields=['user', 'question'], update_fields=['choice'],
+            )
+        if not changes:
+            return changes
+        deltas = Counter()
+        for (_, question_id), (old_choice_id, new_choice_id) in changes.items():
+            if old_choice_id is not None:
+                deltas[question_id, old_choice_id] -= 1
+            deltas[question_id, new_choice_id] += 1
+        apply_count_deltas(deltas, shards)
+        add_to_rollups(deltas, now)
+        Question.objects.filter(pk__in={question_id for _, question_id in changes}).update(last_vote_at=now)
+        transaction.on_commit(lambda: _after_commit(changes))
+    return changes
+
+
+def _take_write_lock():
+    """
+    Take SQLite's write lock as the vote transaction starts.
+
+    SQLite has no row locks: ``select_for_update`` reads under a shared lock,
+    and upgrading it for the writes fails at once with "database is locked"
+    when another connection is writing, whatever the busy timeout.  A write
+    that matches no row, as the first statement, takes the write lock up
+    front and waits for it.  Without effect when the connections already
+    begin their transactions with ``BEGIN IMMEDIATE`` (Django 5.1+).
+    """
+    connection = connections[router.db_for_write(Vote)]
+    if connection.vendor != 'sqlite' or connection.settings_dict['OPTIONS'].get('transaction_mode') == 'IMMEDIATE':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'UPDATE {connection.ops.quote_name(Question._meta.db_table)} SET id = id WHERE 0')
+
+
+def _locked_selections(keys):
+    """Return the existing selections among ``keys``, (user_id, question_id) pairs, locking their rows."""
+    keys = set(keys)
+    user_ids = {user_id for user_id, _ in keys}
+    question_ids = {question_id for _, question_id in keys}
+    return {
+        (user_id, question_id): choice_id
+        for user_id, question_id, choice_id in Vote.objects.select_for_update().filter(
+            user_id__in=user_ids, question_id__in=question_ids,
+        ).values_list('user_id', 'question_id', 'choice_id')
+        if (user_id, question_id) in keys
+    }
+
+
+def _after_commit(changes):
+    """Invalidate the cached results, update the vote index and notify live subscribers of committed changes."""
+    selections = defaultdict(dict)
+    for (user_id, question_id), (_, new_choice_id) in changes.items():
+        selections[question_id][user_id] = new_choice_id
+    for question_id, users in selections.items():
+        voteindex.record(question_id, users, bump_version(question_id))
+    publish_changes(changes)
+
+
+def rebuild_vote_counts(check_only=False):
+    """
+    Compare every choice's counter with the votes actually recorded for it.
+
+    Args:
+        check_only (bool): Only report mismatches, do not fix them.
+
+    Returns:
+        list: (choice_id, counter, actual) for every choice that was out of step.
+    """
+    mismatches = []
+    question_ids = set()
+    # the votes of archived questions are no longer in the Vote table
+    choices = Choice.objects.filter(question__votes_archived_at__isnull=True).annotate(
+        counter=choice_votes(), actual=Count('vote'),
+    ).values_list('id', 'question_id', 'counter', 'actual')
+    # compare against the primary, a lagging replica would report false mismatches
+    with pin_primary():
+        for choice_id, question_id, counter, actual in choices.iterator():
+            if counter != actual:
+                mismatches.append((choice_id, counter, actual))
+                question_ids.add(question_id)
+    if not check_only:
+        with transaction.atomic():
+            for choice_id, _, actual in mismatches:
+                Choice.objects.filter(pk=choice_id).update(vote_count=actual)
+            ChoiceCounterShard.objects.filter(choice_id__in=[choice_id for choice_id, _, _ in mismatches]).delete()
+            # a new Last-Modified, so the pages' ETags and cached fragments change with the tallies
+            Question.objects.filter(pk__in=question_ids).update(updated_at=timezone.now())
+        for question_id in question_ids:
+            bump_version(question_id)
+    return mismatches